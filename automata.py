@@ -0,0 +1,37 @@
+#!/usr/bin/python
+
+import numpy as np
+
+
+class CellularAutomaton:
+    """Runs cellular automaton rules over a 2D grid of tile IDs indexed [y, x]. The automaton keeps two buffers of the
+    same size and swaps between them on every step, so a rule always reads a consistent copy of the previous
+    generation while writing the next one and no memory is allocated for the cells after the first step."""
+    def __init__(self, cells):
+        self.cells = cells
+        self.buffer = np.empty_like(cells)
+
+        # the number of neighbours each cell has on the map, fewer along the edges and in the corners
+        self.neighbour_count = self.neighbour_sum(np.ones(cells.shape, dtype=np.int32))
+
+    def neighbour_sum(self, values):
+        """Sums a grid of values over the eight neighbours of every cell, treating cells off the map as zero."""
+        h, w = values.shape
+        padded = np.zeros((h + 2, w + 2), dtype=np.int32)
+        padded[1:-1, 1:-1] = values
+
+        total = np.zeros((h, w), dtype=np.int32)
+        for dy in range(3):
+            for dx in range(3):
+                if dy != 1 or dx != 1:
+                    total += padded[dy:dy + h, dx:dx + w]
+        return total
+
+    def step(self, rule):
+        """Runs a single generation. The rule is given the current cells to read from and the next generation to
+        write to, which starts out as a copy of the current cells. Returns whatever the rule returns, the new
+        generation is left in self.cells."""
+        self.buffer[...] = self.cells
+        result = rule(self.cells, self.buffer)
+        self.cells, self.buffer = self.buffer, self.cells
+        return result
@@ -0,0 +1,208 @@
+#!/usr/bin/python
+"""Headless benchmark of the map generators. Generates every map type at each size from fixed seeds, timing each
+stage of the generators separately, and writes the results out as JSON. Passing a previous report with --baseline
+compares the two and exits with an error if any stage has become slower than the tolerance allows."""
+
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import tempfile
+
+# No window or sound is needed, so use the dummy SDL drivers
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+os.environ['SDL_AUDIODRIVER'] = 'dummy'
+# and keep pygame's welcome message out of the report
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+
+import pygame
+
+import config
+import generators
+import map
+
+MAP_TYPES = ['island', 'continents', 'highlands', 'deserts']
+
+# The stages of each generator to time. A stage which calls another is timed including the stage it calls.
+STAGES = {
+    generators.MainGenerator: [
+        'gen_simple_noise', 'mask_radial', 'mask_hyperbolic', 'mask_linear', 'merge_images', 'brighten_image',
+        'increase_contrast', 'erosion', 'set_sea_level'
+    ],
+    generators.GameMapGenerator: [
+        'begin_attempt', 'gen_from_image', 'gen_beaches', 'gen_snow', 'define_islands', 'define_landmass',
+        'gen_rivers', 'gen_forests', 'gen_ore_veins', 'select_player_startpoint'
+    ]
+}
+
+
+class Timeout(Exception):
+    pass
+
+
+class StageTimer:
+    """Wraps the stage methods of the generators so that every call is timed into the current run."""
+    def __init__(self):
+        self.stages = {}
+
+    def install(self):
+        for cls, names in STAGES.iteritems():
+            for name in names:
+                setattr(cls, name, self.wrap(name, getattr(cls, name)))
+
+    def wrap(self, name, method):
+        def timed(*args, **kwargs):
+            started = time.time()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                stage = self.stages.setdefault(name, {'calls': 0, 'time': 0.0})
+                stage['calls'] += 1
+                stage['time'] += time.time() - started
+        return timed
+
+    def reset(self):
+        self.stages = {}
+
+
+def run_case(timer, map_type, size, seed, time_limit):
+    """Generates a single map, returning the time taken by each stage. Generation is abandoned once the time limit
+    is reached, in case a change to the generators stops them from finishing."""
+    data = {'map': map_type, 'rainfall': 1, 'resources': 1, 'size': size, 'difficulty': 1, 'seed': seed}
+    result = {'map': map_type, 'size': size, 'seed': seed, 'status': 'ok'}
+
+    def expired(signum, frame):
+        raise Timeout()
+
+    timer.reset()
+    signal.signal(signal.SIGALRM, expired)
+    signal.alarm(time_limit)
+
+    # the generators report their progress on stdout, keep it out of the report
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    started = time.time()
+    try:
+        game_map = map.Map(None, (config.SCREEN_X, config.SCREEN_Y), data)
+        # the number of ore tiles placed, to check the resources setting against
+        coal, oil = game_map.ore_counts.sum(axis=0).tolist()
+        result['ores'] = {'coal': coal, 'oil': oil}
+    except Timeout:
+        result['status'] = 'timeout'
+    except generators.GenerationError:
+        result['status'] = 'failed'
+    finally:
+        signal.alarm(0)
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    result['total'] = time.time() - started
+    result['stages'] = timer.stages
+    result['attempts'] = timer.stages.get('begin_attempt', {}).get('calls', 0)
+    return result
+
+
+def case_key(case):
+    return "{}/{}/{}".format(case['map'], case['size'], case['seed'])
+
+
+def best_of(runs):
+    """Combines repeated runs of a case, keeping the fastest time seen for each stage."""
+    best = dict(runs[0])
+    best['total'] = min(run['total'] for run in runs)
+    best['stages'] = {}
+    for run in runs:
+        if run['status'] != 'ok':
+            best['status'] = run['status']
+        for name, stage in run['stages'].iteritems():
+            if name not in best['stages'] or stage['time'] < best['stages'][name]['time']:
+                best['stages'][name] = dict(stage)
+    return best
+
+
+def compare(report, baseline, tolerance, min_delta):
+    """Compares a report against a baseline report. Returns a list of regressions, where a regression is a stage or
+    total more than the tolerance slower than before (and by more than min_delta seconds, to ignore noise in the
+    fastest stages), or a case which completed in the baseline but no longer does."""
+    regressions = []
+    previous = dict((case_key(case), case) for case in baseline['cases'])
+
+    for case in report['cases']:
+        key = case_key(case)
+        if key not in previous:
+            continue
+        old = previous[key]
+
+        if old['status'] == 'ok' and case['status'] != 'ok':
+            regressions.append("{}: {} (was ok)".format(key, case['status']))
+            continue
+
+        timings = [('total', old['total'], case['total'])]
+        for name, stage in case['stages'].iteritems():
+            if name in old['stages']:
+                timings.append((name, old['stages'][name]['time'], stage['time']))
+
+        for name, before, after in timings:
+            if after > before * (1 + tolerance) and after - before > min_delta:
+                regressions.append("{} {}: {:.3f}s -> {:.3f}s ({:+.0f}%)".format(
+                    key, name, before, after, (after / before - 1) * 100 if before > 0 else 100))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks every stage of the map generators.")
+    parser.add_argument('--maps', nargs='+', default=MAP_TYPES, choices=MAP_TYPES)
+    parser.add_argument('--sizes', nargs='+', type=int, default=[0, 1])
+    parser.add_argument('--seeds', nargs='+', type=int, default=[1, 2])
+    parser.add_argument('--repeat', type=int, default=1, help="runs of each case, keeping the fastest stage times")
+    parser.add_argument('--time-limit', type=int, default=60, help="seconds before a case is abandoned")
+    parser.add_argument('--output', help="file to write the report to, instead of stdout")
+    parser.add_argument('--baseline', help="a previous report to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown, as a fraction")
+    parser.add_argument('--min-delta', type=float, default=0.05, help="slowdowns in seconds always allowed")
+    args = parser.parse_args()
+
+    pygame.init()
+    pygame.display.set_mode((1, 1))
+
+    # never load maps from the cache, and keep the generated ones out of it
+    config.CACHE_DIR = tempfile.mkdtemp()
+    config.CACHE_SIZE = 0
+
+    timer = StageTimer()
+    timer.install()
+
+    report = {'generator_version': generators.GENERATOR_VERSION, 'cases': []}
+    for map_type in args.maps:
+        for size in args.sizes:
+            for seed in args.seeds:
+                runs = [run_case(timer, map_type, size, seed, args.time_limit) for i in range(args.repeat)]
+                case = best_of(runs)
+                report['cases'].append(case)
+                print >> sys.stderr, "{:<24} {:>8} {:.3f}s".format(case_key(case), case['status'], case['total'])
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print output
+
+    os.rmdir(config.CACHE_DIR)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance, args.min_delta)
+        for regression in regressions:
+            print >> sys.stderr, "REGRESSION", regression
+        if regressions:
+            sys.exit(1)
+        print >> sys.stderr, "No regressions against {}".format(args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -18,23 +18,25 @@ class Building:
 
     def can_place(self, tile_at, map=None):
         """By default, all buildings can be provided they are near road. Can be overridden with specific use cases."""
-        True
+        return True
 
     def locked(self, player):
         """By default, all buildings are unlocked. Can be overridden with specific use cases."""
         return False
 
 class House(Building):
-    """A basic small house."""
-    def __init__(self, id="HOUSE", price=400, population=random.randint(2, 4)):
+    """A basic small house. The population is drawn from the given random stream when it isn't specified."""
+    def __init__(self, id="HOUSE", price=400, population=None, rng=random):
+        if population is None:
+            population = rng.randint(2, 4)
         Building.__init__(self, id, price, 3*population,'r')
         self.population = population
         self.requiredJobs = math.ceil(population / 2) if population > 3 else population
 
 class BigHouse(House):
     """A basic larger house."""
-    def __init__(self):
-        House.__init__(self, "BIGHOUSE", 600, random.randint(4, 6))
+    def __init__(self, rng=random):
+        House.__init__(self, "BIGHOUSE", 600, rng.randint(4, 6))
 
     def locked(self, player):
         return player.population < 100
@@ -42,8 +44,8 @@ class BigHouse(House):
 
 class Apartments(House):
     """A large block of apartments."""
-    def __init__(self):
-        House.__init__(self, "APARTMENTS", 1200, random.randint(12, 20))
+    def __init__(self, rng=random):
+        House.__init__(self, "APARTMENTS", 1200, rng.randint(12, 20))
 
     def locked(self, player):
         return player.population < 500
@@ -89,7 +91,7 @@ class CoalMine(Building):
         self.jobs = 20
 
     def can_place(self, tile_at, map=None):
-        return tile_at['tile']['layer_0'] in ['GROUNDCOAL','GRASSCOAL','SANDCOAL']
+        return bool(map.is_coal[map.get_id(tile_at['map_xy'], 'layer_0')])
 
 class OilRig(Building):
     def __init__(self):
@@ -97,7 +99,7 @@ class OilRig(Building):
         self.jobs = 60
 
     def can_place(self, tile_at, map=None):
-        return tile_at['tile']['layer_0'] in ['GROUNDOIL','GRASSOIL','SANDOIL','WATEROIL']
+        return bool(map.is_oil[map.get_id(tile_at['map_xy'], 'layer_0')])
 
     def locked(self, player):
         return player.population < 200
@@ -109,15 +111,8 @@ class FerryTerminal(Building):
         self.jobs = 5
 
     def can_place(self, tile_at, map=None):
-        x,y = tile_at['map_xy']
-        place = False
         # If there is a shoreline within a single tile, it can be placed
-        if (x > 0 and map.get(((x-1), y))['layer_0'] == 'SHORE') or \
-            (x < map.size[0] - 1 and map.get((x+1, y))['layer_0'] == 'SHORE') or \
-                (y > 0 and map.get((x,y-1))['layer_0'] == 'SHORE') or \
-                (y < map.size[1] - 1 and map.get((x, y+1))['layer_0'] == 'SHORE'):
-            place = True
-        return place
+        return map.near_shore(tile_at['map_xy'])
 
     def locked(self, player):
         return player.population < 400
\ No newline at end of file
@@ -18,6 +18,9 @@ global TITLE_FONT
 global COLOR_G
 global COLOR_R
 
+global MAP_SEED
+global MAP_POOL
+
 # tile dimensions
 TILE_W, TILE_H = (24,24)
 
@@ -32,3 +35,17 @@ SCREEN_SIZE = (SCREEN_X * TILE_W + SIDEBAR_WIDTH, SCREEN_Y*TILE_H + STATUSBAR_HE
 COLOR_G = (50, 240, 120)
 COLOR_R = (240, 70, 70)
 COLOR_GRAY = (150,150,150)
+
+# the most frames drawn a second in the game, and the ticks of the simulation run a second however fast it draws
+FRAME_RATE = 60
+TICK_RATE = 30
+
+# where generated maps are cached, and the most space in bytes the cache may use
+CACHE_DIR = "cache"
+CACHE_SIZE = 64 * 1024 * 1024
+
+# the seed used for new maps, picked at startup if not set so that the same settings give the same map in a session
+MAP_SEED = None
+
+# the pool generating maps in the background, created when the game starts
+MAP_POOL = None
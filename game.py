@@ -4,13 +4,18 @@ import pygame.locals
 import time
 # game imports
 import config
+import generators
 import map
+import mappool
 import ui
 
 
 screens = []
 
 def run():
+    # start the map generation workers before pygame is set up, so they don't inherit the window
+    config.MAP_POOL = mappool.MapPool()
+
     screen = pygame.display.set_mode(
         (config.TILE_W * config.SCREEN_X + config.SIDEBAR_WIDTH, (config.TILE_H * config.SCREEN_Y) + config.STATUSBAR_HEIGHT))
     pygame.init()
@@ -19,6 +24,9 @@ def run():
     config.FONT = pygame.font.Font("src/Bugsmirc05.ttf", 16)
     config.TITLE_FONT = pygame.font.Font("src/Bugsmirc05.ttf", 32)
 
+    if config.MAP_SEED is None:
+        config.MAP_SEED = generators.random_seed()
+
     open_screen(screen, 'menu', False)
 
 def open_screen(screen, opt, close, data=None):
@@ -39,4 +47,11 @@ def open_screen(screen, opt, close, data=None):
         cs = ui.ConfigureScreen(screen, open_screen)
         screens.append(cs)
         cs.open()
-run()
\ No newline at end of file
+
+
+try:
+    run()
+finally:
+    # stop the workers generating maps no one will play
+    if config.MAP_POOL is not None:
+        config.MAP_POOL.shutdown()
@@ -1,51 +1,224 @@
 #!/usr/bin/python
 
-import sys
-import copy
+import time
 import random
+import hashlib
 import numpy as np
 
-import noiselib
-import pygame
 import math
 
-from noiselib import fBm, simplex_noise2
-from noiselib.modules.surfaces import PixelArray, RGBLerpNoise
-from noiselib.modules.main import RescaleNoise
-
 from PIL import Image
 
 import config
+from automata import CellularAutomaton
+from erosion import ErosionEngine
+from heightfield import Heightfield
+from hydrology import FlowNetwork
+from regions import label_regions, region_tiles
+from simplex import SimplexNoise
+from src.diamondsquare import DiamondSquare
+from tiles import TILE_IDS, IMPASSABLE, COAL, OIL, tile_table, ore_table
+
+# The version of the generators, bump this whenever a change alters the maps generated from a seed so that any cached
+# maps are generated again
+GENERATOR_VERSION = 9
+
+# Lookup table over the tile IDs which is True for the impassable tiles
+IS_IMPASSABLE = tile_table(IMPASSABLE)
+
+# The ground tiles of each map type by height, and what is scattered over them. A height below the first threshold
+# gets the first tile, a height from one threshold up to the next the tile after, and so on. Each decoration is a
+# layer_1 tile, the ground tiles it can be placed on and the chance of it being placed on each of them. Map types
+# without a table of their own use the default.
+TERRAIN = {
+    'default': {
+        'thresholds': [50, 100, 200, 230],
+        'tiles': ['OCEAN', 'SHORE', 'GRASS', 'GROUND', 'SNOW'],
+        'decoration': [('MOUNTAIN', ['GROUND', 'SNOW'], 1 / 41.)]
+    },
+    'deserts': {
+        'thresholds': [50, 100],
+        'tiles': ['OCEAN', 'SHORE', 'SAND'],
+        'decoration': [('PALMTREE', ['SAND'], 1 / 51.)]
+    }
+}
+
+# The (x, y) step forests grow by going up, down, left and right, and the directions a branch can turn into from each
+GROWTH_STEPS = [(0, -1), (0, 1), (-1, 0), (1, 0)]
+GROWTH_TURNS = [(2, 3), (2, 3), (0, 1), (0, 1)]
+
+# How many times a forest may grow out of a tile in each direction. Branches often retrace each other, and the cap
+# keeps the work proportional to the size of the forest while leaving room for the overlapping branches to fill out.
+GROWTH_VISITS = 4
+
+# Lookup table indexed [ore, tile ID] giving the tile each tile becomes with the ore, or -1 where it can't hold it
+ORE_TABLE = ore_table()
+
+# The (x, y) steps an oil field can spread by, each of which it takes with a chance of one in two
+OIL_STEPS = [(-2, -2), (-2, 2), (2, -2), (2, 2)]
+
+# How many branches of a vein may carry on from the same tile at each step. Branches which meet would otherwise be
+# grown again and again, but cutting them down to one leaves veins thinner than they were grown one at a time.
+VEIN_BRANCHES = 2
+
+# The pipeline stages of the game map generator, each of which draws from its own random stream
+STAGES = ['terrain', 'rivers', 'forests', 'ores', 'beaches', 'start']
+
+# The area of the largest map generated in one piece, which chunks of larger worlds are eroded as densely as
+CHUNK_AREA = 256 * 256
+
+# How many times the terrain may be generated from scratch before giving up on the map
+MAX_ATTEMPTS = 5
+
+# The space needed around the town hall at the start location, as (left, right, top, bottom) offsets from it. The
+# relaxed footprint is the least space it can be squeezed into, with just the road beneath it.
+START_FOOTPRINT = (-2, 2, -1, 1)
+RELAXED_START_FOOTPRINT = (-1, 1, 0, 1)
+
+
+def random_seed():
+    """Picks a new master seed for a map."""
+    return random.randint(0, 2 ** 31 - 1)
+
+
+def derive_seed(seed, *keys):
+    """Derives the seed of an independent random stream from a master seed and any number of keys, such as the name
+    of a pipeline stage. The same seed and keys always give the same stream."""
+    digest = hashlib.md5(repr((seed,) + keys)).hexdigest()
+    return int(digest[:8], 16)
+
+
+def gen_terrain(heights, layer_0, layer_1, map_type, rng):
+    """Fills in the ground tiles of the layers from the heights of a heightfield, all indexed [y, x], using the
+    terrain table of the map type. The decorations are scattered using a single draw of random numbers for the whole
+    map, seeded from the given random stream."""
+    terrain = TERRAIN.get(map_type, TERRAIN['default'])
+    tiles = np.array([TILE_IDS[tile] for tile in terrain['tiles']], dtype=np.uint8)
+    layer_0[:] = tiles[np.digitize(heights, terrain['thresholds'])]
+
+    draws = np.random.RandomState(rng.randint(0, 2 ** 32 - 1)).random_sample(heights.shape)
+    for tile, ground, chance in terrain['decoration']:
+        layer_1[tile_table(ground)[layer_0] & (draws < chance)] = TILE_IDS[tile]
+
+
+def gen_beaches(layer_0, layer_1, rng):
+    """Runs the beach automaton over the ground layer, returning the new ground layer. Palm trees are added to the
+    beaches in layer_1 with the given random stream, drawn column by column."""
+    automaton = CellularAutomaton(layer_0)
+
+    # the sea pulls a tile towards being shore and the land pulls it towards being land, ice is neutral
+    scores = np.where(IS_IMPASSABLE, 0, 1)
+    scores[TILE_IDS['OCEAN']] = -2
+    scores[TILE_IDS['SHORE']] = -1
+
+    def beaches(cells, next_cells):
+        # the tile itself only affects the automata value if it is water
+        impassable = IS_IMPASSABLE[cells]
+        tiles = automaton.neighbour_sum(scores[cells]) + np.where(impassable, scores[cells], 0)
+        half = (automaton.neighbour_count + impassable) // 2
 
-class MainGenerator:
-    """Generates raw heightmaps with no additional features to be used by the game map generators."""
-    def __init__(self):
-        noiselib.init(256)
-        pass
+        sand = (tiles > -half) & (tiles < half)
+        next_cells[(tiles <= -half) & (cells != TILE_IDS['OCEAN'])] = TILE_IDS['SHORE']
+        next_cells[sand] = TILE_IDS['SAND']
+        return sand
 
-    # Generators
-    def gen_simple_noise(self, scale):
-        res = 2 ** scale if scale < 8 else 2 ** 8
-        size = (res, res)
-        # Generate the noise using noiselib
-        src = fBm(8, 0.45, simplex_noise2)
-        src = RescaleNoise((-1, 1), (0, 1), src)
-        colors = ((0, 0, 0), (233, 233, 233), 1)
-        src = RGBLerpNoise(colors, src)
+    sand = automaton.step(beaches)
 
-        surface = pygame.Surface((size[0] * 2, size[1] * 2))
-        PixelArray(surface, src)
+    # Add a small chance of adding a palm tree to each beach tile
+    xs, ys = np.nonzero(sand.T)
+    palms = np.array([rng.randint(0, 100) < 5 for i in range(len(xs))], dtype=bool)
+    layer_1[ys[palms], xs[palms]] = TILE_IDS['PALMTREE']
+    return automaton.cells
 
-        surface = pygame.transform.smoothscale(surface, size)
 
-        return surface
+def gen_snow(layer_0):
+    """Runs the snow automaton over the ground layer, returning the new ground layer."""
+    automaton = CellularAutomaton(layer_0)
 
-    def gen_island(self, scale, rainfall):
-        """Generates an island map."""
+    def snow(cells, next_cells):
+        snow = automaton.neighbour_sum(cells == TILE_IDS['SNOW'])
+        ground = automaton.neighbour_sum(cells == TILE_IDS['GROUND'])
+        grass = automaton.neighbour_sum(cells == TILE_IDS['GRASS'])
+
+        # if it is snow and is isolated, clip it
+        isolated = (cells == TILE_IDS['SNOW']) & (snow <= 2)
+        next_cells[isolated] = np.where(ground > grass, TILE_IDS['GROUND'], TILE_IDS['GRASS'])[isolated]
+        # if more than two neighbours are snow, this tile should be snow
+        next_cells[snow > 2] = TILE_IDS['SNOW']
+
+    automaton.step(snow)
+    return automaton.cells
+
+
+def count_ores(map):
+    """Counts the coal and oil tiles on each island of a map, returning an array indexed [island label, COAL or OIL].
+    Row 0 counts the ore out at sea, which is the oil fields reaching out over the shore."""
+    layer_0 = np.asarray(map.layers['layer_0'])
+    labels = np.asarray(map.island_labels)
+    size = int(labels.max()) + 1 if labels.size else 1
+
+    counts = np.zeros((size, 2), dtype=np.int64)
+    counts[:, COAL] = np.bincount(labels[map.is_coal[layer_0]], minlength=size)
+    counts[:, OIL] = np.bincount(labels[map.is_oil[layer_0]], minlength=size)
+    return counts
+
+
+class GenerationError(Exception):
+    """Raised when no playable map could be generated within the attempt budget."""
+    pass
+
+
+class MainGenerator:
+    """Generates raw heightmaps with no additional features to be used by the game map generators. The noise and the
+    erosion each draw from a stream derived from the master seed, so the same seed always gives the same heightmap.
+    The heightmaps are built on simplex noise, or on diamond-square noise for the 'diamondsquare' base."""
+    def __init__(self, seed=None, base='simplex'):
+        self.seed = random_seed() if seed is None else seed
+        self.base = base
+
+        # shuffle the permutation table of the noise from the seed rather than the global random module
+        perm = range(256)
+        random.Random(derive_seed(self.seed, 'noise')).shuffle(perm)
+        self.noise = SimplexNoise(perm)
+
+    # Generators
+    def gen_noise(self, origin, size, supersample=1):
+        """Generates 8 octaves of fBm simplex noise over an area of the world, given by the (x, y) of its top left
+        corner and its (width, height). Tiles are two units of noise across and the heights reach up to 233, the
+        scale the noise has always been generated at. Supersampling averages the noise over more points within each
+        tile, for a smoother heightfield at the cost of time."""
+        if self.base == 'diamondsquare':
+            # diamond-square builds the whole grid at once, so can't be generated a piece of a world at a time
+            if origin != (0, 0):
+                raise ValueError("Diamond-square noise can only be generated for a whole map")
+            return self.gen_diamond_square(size)
+
+        heights = np.floor(233 * self.noise.field(origin, size, 2, supersample))
+        return Heightfield(size, heights.astype(np.float32), origin)
+
+    def gen_diamond_square(self, size, rough=1.0):
+        """Generates diamond-square noise over a heightfield of the given (width, height), spread over the same range
+        of heights as the simplex noise so that the map types shape it the same way."""
+        square = DiamondSquare(max(size), (0, 0, 0, 0), derive_seed(self.seed, 'noise'))
+        heights = square.generate(rough)[:size[1], :size[0]]
+
+        # the simplex noise averages around 117 with a standard deviation of 30
+        heights = 117 + 30 * (heights - heights.mean()) / max(heights.std(), 1e-6)
+        return Heightfield(size, np.floor(np.clip(heights, 0, 233)).astype(np.float32))
+
+    def gen_simple_noise(self, scale, supersample=1):
+        """Generates a square heightfield of noise, 2 ** scale tiles across up to a limit of 256."""
+        res = 2 ** scale if scale < 8 else 2 ** 8
+        return self.gen_noise((0, 0), (res, res), supersample)
+
+    def gen_island(self, scale, rainfall, slate=None):
+        """Generates an island map. Each of the map generators can be given a noise heightfield, such as a chunk of
+        a larger world, in place of generating one."""
         # Generate a standard map
 
         # If the scale is 5 or below generate at a higher size then scale down for better results
-        slate = self.gen_simple_noise(scale)
+        if slate is None:
+            slate = self.gen_simple_noise(scale)
 
         # apply the mask
         slate = self.increase_contrast(slate, 1.4)
@@ -53,10 +226,11 @@ class MainGenerator:
         self.erosion(slate, 4+rainfall)
         return slate
 
-    def gen_continents(self, scale, rainfall):
+    def gen_continents(self, scale, rainfall, slate=None):
         """Generates a map with two large continents."""
         # Generate a standard map
-        slate = self.gen_simple_noise(scale)
+        if slate is None:
+            slate = self.gen_simple_noise(scale)
 
         # apply the mask
         slate = self.increase_contrast(slate, 1.3, 40)
@@ -65,10 +239,11 @@ class MainGenerator:
         return slate
 
 
-    def gen_highlands(self, scale, rainfall):
+    def gen_highlands(self, scale, rainfall, slate=None):
         """Generates a highland map with high-up land, higher resources and less water or trees."""
         # Generate a standard map
-        slate = self.gen_simple_noise(scale)
+        if slate is None:
+            slate = self.gen_simple_noise(scale)
 
         # The third parameter, brightness, is what makes this a highland map with a +100 modifier
         slate = self.increase_contrast(slate, 1.3, 100)
@@ -77,224 +252,141 @@ class MainGenerator:
         return slate
 
     # Overlay masks
-    def mask_radial(self, surface):
-        """Generates a radial mask over an input surface."""
-        size = surface.get_size()
-        output = pygame.Surface(size)
-
-        for y in range(0, size[1]):
-            for x in range(0, size[0]):
-                loc = (x - size[0] * 0.5, y - size[1] * 0.5)
-                d = float(math.sqrt(loc[0] ** 2 + loc[1] ** 2))
-
-                m = float(size[0]) * 0.5
-                change = max(0.0, 1.0 - (d / m)) * 2.5
-
-                # only want to *darken* colors when applying this mask,
-                # otherwise appears totally washed out
-                old_color = surface.get_at((x, y)).r
-
-                color = int(round(float(old_color * change)))
-                if color > old_color:
-                    color = old_color
-                output.set_at((x, y), pygame.Color(color, color, color, 255))
-        return output
-    def mask_hyperbolic(self, surface):
-        """Generates a hyperbolic paraboloid mask over an input surface."""
-        size = surface.get_size()
-        output = pygame.Surface(size)
-        for y in range(0, size[1]):
-            for x in range(0, size[0]):
-                useX = (float(x) / (float(size[0]) / 2)) - 1.0
-                useY = (float(y) / (float(size[1]) / 2)) - 1.0
-
-                z = (useX ** 2 - useY ** 2) * 2 + 0.5
-                old_color = surface.get_at((x, y)).r
-                color = int(round(float(max(0.0, old_color * z))))
-
-                if color > old_color:
-                    color = old_color
-                output.set_at((x, y), pygame.Color(color, color, color, 255))
-
-        return output
-    def mask_linear(self, surface):
-        """Generates a linear mask over an input surface."""
-        size = surface.get_size()
-        output = pygame.Surface(size)
-        for y in range(0, size[1]):
-            for x in range(0, size[0]):
-                useX = float(x) / float(size[0] / 2) - 1.0
-                useY = float(y) / float(size[0] / 2) - 1.0
-
-                z = ((-useY) ** 2) * 3
-                old_color = surface.get_at((x, y)).r
-                color = int(round(float(max(0.0, old_color * z))))
-
-                if color > old_color:
-                    color = old_color
-                output.set_at((x, y), pygame.Color(color, color, color, 255))
-
-        return output
+    def mask_radial(self, heightfield):
+        """Generates a radial mask over an input heightfield."""
+        w, h = heightfield.get_world_size()
+        x, y = self.grid_coords(heightfield)
 
-    # Utility functions
-    def merge_images(self, mode, *args):
-        """Merge two images together, with the output image pixel values being the average of both of the input
-        images. Images must be the same size."""
-        size = args[0].get_size()
-        slate = pygame.Surface(size)
+        d = np.sqrt((x - w * 0.5) ** 2 + (y - h * 0.5) ** 2)
+        m = float(w) * 0.5
+        change = np.maximum(0.0, 1.0 - (d / m)) * 2.5
 
-        for surface in args:
-            if surface.get_size() != size:
-                print "Sizes do not match!"
+        # only want to *darken* colors when applying this mask,
+        # otherwise appears totally washed out
+        return self.apply_mask(heightfield, change)
 
-        for y in range(0, size[1]):
-            for x in range(0, size[0]):
-                average = []
-                for surface in args:
-                    color = surface.get_at((x, y))
-                    average.append((color.r + color.g + color.b) // 3)
-                if mode == "average":
-                    av = int(round(sum(average) / len(average)))
-                elif mode == "multiply":
-                    av = int(min(average))
-                try:
-                    slate.set_at((x, y), pygame.Color(av, av, av, 255))
-                except Exception, e:
-                    print av
-        return slate
-    def brighten_image(self, surface, factor):
-        """Brightens an image by multiplying by an input factor."""
-        size = surface.get_size()
-
-        for y in range(0, size[1]):
-            for x in range(0, size[0]):
-                color = surface.get_at((x, y))
-                new_color = pygame.Color(color.r * factor, color.g * factor, color.b * factor, 255)
-                surface.set_at((x, y), new_color)
-        return surface
-
-    def increase_contrast(self, surface, factor, brightness=0):
-        """Increases the contract of an input surface by given factor, with option for a brightness modifier"""
-        size = surface.get_size()
-
-        for y in range(0, size[1]):
-            for x in range(0, size[0]):
-                old_color = surface.get_at((x, y)).r
-                new_color = int((factor * (old_color - 128)) + 128 + brightness)
-                if new_color < 0:
-                    new_color = 0
-                elif new_color > 255:
-                    new_color = 255
-                try:
-                    surface.set_at((x, y), pygame.Color(new_color, new_color, new_color, 255))
-                except Exception, e:
-                    print new_color
-        return surface
+    def mask_hyperbolic(self, heightfield):
+        """Generates a hyperbolic paraboloid mask over an input heightfield."""
+        w, h = heightfield.get_world_size()
+        x, y = self.grid_coords(heightfield)
 
-    def averageRGB(self, color):
-        """Averages the RGB values into a grayscale color."""
-        return int((color.r + color.g + color.b) / 3)
+        useX = (x / (float(w) / 2)) - 1.0
+        useY = (y / (float(h) / 2)) - 1.0
 
-    # Erosion algorithms
-    def erosion(self, surface, factor=3):
-        """'Erodes' an input surface through the use of a simulated rainfall function. Power or strength of the erosion
-        can be controlled with the input factor."""
+        z = (useX ** 2 - useY ** 2) * 2 + 0.5
+        return self.apply_mask(heightfield, z)
 
-        times_to_run = 10000 * factor
-        size = surface.get_size()
+    def mask_linear(self, heightfield):
+        """Generates a linear mask over an input heightfield."""
+        w, h = heightfield.get_world_size()
+        y = self.grid_coords(heightfield)[1]
 
-        while times_to_run > 0:
-            xy = random.randint(0, size[0] - 1), random.randint(0, size[1] - 1)
-            self.erode(surface, size, xy)
-            times_to_run -= 1
+        useY = y / float(w / 2) - 1.0
 
-        pygame.image.save(surface, "erosion_test2.png")
-    def erode(self, surface, size, xy):
-        """Helper function for erosion. A recursive virtual raindrop that will run down the edges of a mountain on
-        the map and erode the terrain as it passes, creating smooth grooves in the landscape. Takes the surface, the
-        the size of the surface and the current co-ordinates"""
-        x, y = xy
-        av = self.averageRGB(surface.get_at(xy))
+        z = ((-useY) ** 2) * 3
+        return self.apply_mask(heightfield, z)
 
-        av = int(av - random.randint(1, 2))
+    def apply_mask(self, heightfield, mask):
+        """Multiplies a heightfield by a mask, rounding to whole heights. Masks may only darken the heightfield."""
+        old = heightfield.data.astype(np.float64)
+        masked = np.floor(np.maximum(0.0, old * mask) + 0.5)
+        return Heightfield(heightfield.get_size(), np.minimum(masked, old).astype(np.float32), heightfield.origin,
+                           heightfield.world_size)
 
-        if av < 20:
-            return
+    def grid_coords(self, heightfield):
+        """Returns float arrays of the x and y coordinate in the world of every point in the heightfield."""
+        w, h = heightfield.get_size()
+        y, x = np.mgrid[0:h, 0:w]
+        return (x + heightfield.origin[0]).astype(np.float64), (y + heightfield.origin[1]).astype(np.float64)
 
-        if av > 255:
-            av = 255
+    # Utility functions
+    def merge_images(self, mode, *args):
+        """Merge two heightfields together, with the output heights being the average of both of the input
+        heightfields. Heightfields must be the same size."""
+        size = args[0].get_size()
 
-        dirs = {
-            'top': 0,
-            'bottom': 0,
-            'left': 0,
-            'right': 0
-        }
+        for heightfield in args:
+            if heightfield.get_size() != size:
+                print "Sizes do not match!"
 
-        # if at the extremes of the generated map, assume the pixel value is slightly higher to prevent runoff without
-        # skewing averages
-        dirs['top'] = av + 1 if y == 0 else self.averageRGB(surface.get_at((x, y - 1)))
-        dirs['bottom'] = av + 1 if y == size[1] - 1 else  self.averageRGB(surface.get_at((x, y + 1)))
-        dirs['left'] = av + 1 if x == 0 else self.averageRGB(surface.get_at((x - 1, y)))
-        dirs['right'] = av + 1 if x == size[0] - 1 else self.averageRGB(surface.get_at((x + 1, y)))
+        stack = np.array([heightfield.data for heightfield in args], dtype=np.float64)
+        if mode == "average":
+            merged = np.floor(stack.sum(axis=0) / len(args))
+        elif mode == "multiply":
+            merged = stack.min(axis=0)
+        return Heightfield(size, merged.astype(np.float32))
 
-        mean_of_dirs = int((dirs['top'] + dirs['bottom'] + dirs['left'] + dirs['right']) / 4)
+    def brighten_image(self, heightfield, factor):
+        """Brightens a heightfield by multiplying by an input factor."""
+        heightfield.data[:] = np.clip(np.trunc(heightfield.data * factor), 0, 255)
+        return heightfield
 
-        # this prevents the raindrops from 'drilling' holes into the map, if the average of the directions around it are
-        # signficantly greater than the spot, don't continue
-        if mean_of_dirs - 2 > av:
-            return
+    def increase_contrast(self, heightfield, factor, brightness=0):
+        """Increases the contract of an input heightfield by given factor, with option for a brightness modifier"""
+        old = heightfield.data.astype(np.float64)
+        heightfield.data[:] = np.clip(np.trunc((factor * (old - 128)) + 128 + brightness), 0, 255)
+        return heightfield
 
-        surface.set_at(xy, pygame.Color(av, av, av, 255))
+    def averageRGB(self, color):
+        """Averages the RGB values into a grayscale color."""
+        return int((color.r + color.g + color.b) / 3)
 
-        possible_dirs = []
-        for dir, value in dirs.iteritems():
-            if value < av or (value == av and random.randint(0, 1) == 1):
-                possible_dirs.append(dir)
+    # Erosion algorithms
+    def erosion(self, heightfield, factor=3, seed=None, batch_size=1024):
+        """'Erodes' an input heightfield through the use of a simulated rainfall function. Power or strength of the
+        erosion can be controlled with the input factor. The raindrops are simulated in batches by the erosion engine,
+        seeded from the given seed or the generator's erosion stream. A chunk of a larger world gets the same density
+        of raindrops as a map of CHUNK_AREA tiles, and a stream of its own."""
+        droplets = 10000 * factor
+        if heightfield.world_size is not None:
+            droplets = int(droplets * heightfield.data.size / float(CHUNK_AREA))
+        if seed is None:
+            seed = derive_seed(self.seed, 'erosion', *(heightfield.origin if heightfield.world_size else ()))
 
-        # if there's flat land pick a random direction
+        engine = ErosionEngine(heightfield.data, seed)
+        stats = engine.run(droplets, batch_size)
 
-        if len(possible_dirs) == 0:
-            return
+        print "Eroded with {} droplets in {:.3f}s ({:.3f}s per million droplet-steps)".format(
+            stats['droplets'], stats['time'], stats['time'] * 1000000 / max(1, stats['steps']))
 
-        if random.randint(0, 1) == 1:
-            selections = [possible_dirs[random.randint(0, len(possible_dirs) - 1)]]
-        else:
-            selections = possible_dirs
-
-        for selection in selections:
-            if selection == 'top':
-                if y > 0:
-                    self.erode(surface, size, (x, y - 1))
-            if selection == 'bottom':
-                if y < size[1] - 1:
-                    self.erode(surface, size, (x, y + 1))
-            if selection == 'left':
-                if x > 0:
-                    self.erode(surface, size, (x - 1, y))
-            if selection == 'right':
-                if x < size[0] - 1:
-                    self.erode(surface, size, (x + 1, y))
-
-    def set_sea_level(self, surface, threshold_value):
-        size = surface.get_size()
-        for y in range(0, size[1]):
-            for x in range(0, size[0]):
-                val = self.averageRGB(surface.get_at((x, y)))
-                if val < threshold_value:
-                    surface.set_at((x, y), pygame.Color(val, val, val, 255))
+    def set_sea_level(self, heightfield, threshold_value):
+        below = heightfield.data < threshold_value
+        heightfield.data[below] = np.floor(heightfield.data[below])
 
 
 class GameMapGenerator:
     """A generator for a playable game map. Calls the MainGenerator functions and produces a map with forests,
-    rivers or other required feature to enable the player to play on the map."""
-    def __init__(self, map, data):
+    rivers or other required feature to enable the player to play on the map.
+
+    The map is generated up to the start location straight away. The rivers, forests and ores are then added by a
+    resumable series of decoration stages, which are run to the end unless streaming is asked for, in which case
+    each call to step runs the next one so the game can be drawn in between."""
+    def __init__(self, map, data, stream=False):
         self.map = map
+        self.stream = stream
 
         self.map_type = data['map']
         self.rainfall = data['rainfall']
         self.resources = data['resources']
 
+        # How the start location is picked from those available, either 'random' or 'central'
+        self.start_placement = data.get('start', 'random')
+
+        # The noise the heightmap is built on, either 'simplex' or 'diamondsquare'
+        self.base = data.get('noise', 'simplex')
+
+        # The master seed that every random stream used by the generator is derived from
+        self.seed = data.get('seed')
+        if self.seed is None:
+            self.seed = random_seed()
+        self.map.seed = self.seed
+        self.attempt = 0
+        self.streams = {}
+
+        # The tiles kept clear for the start location, and the decoration stages still to run
+        self.reserved = None
+        self.decorations = None
+
         self.scale = 5 + (2 * data['size'])
 
         if self.map_type == "island":
@@ -310,73 +402,80 @@ class GameMapGenerator:
             self.rainfall -= 1
             self.gen_island()
 
+    def begin_attempt(self):
+        """Starts a new attempt at generating the map. Every stage gets a fresh random stream derived from the master
+        seed and the attempt number, so a stage drawing more or fewer numbers never shifts the output of the others.
+        Returns a heightmap generator seeded for the attempt."""
+        self.attempt += 1
+        self.streams = dict((stage, random.Random(derive_seed(self.seed, self.attempt, stage))) for stage in STAGES)
+        return MainGenerator(derive_seed(self.seed, self.attempt, 'heightmap'), self.base)
+
     # Map generators
     def gen_empty(self):
         """Generates an empty map (just grass and air)"""
         # blank out any existing map
-        self.map.layer_0, self.map.layer_1 = [], []
-        try:
-            for y in range(0, self.map.size[1]):
-                self.map.layer_0.append([])
-                self.map.layer_1.append([])
-                for x in range(0, self.map.size[0]):
-                    self.map.layer_0[y].append('GRASS')
-                    self.map.layer_1[y].append('UI_EMPTY')
-        except Exception, e:
-            print "Failed at ({},{}) with max dimensions ({},{})".format(x, y, self.map.size[0], self.map.size[1])
-            return None
+        self.map.clear()
 
     def gen_random(self):
         """Generates a map with a random selection of tiles."""
-        self.map.layer_0, self.map.layer_1 = [], []
-        try:
-            for y in range(0, self.map.size[1]):
-                self.map.layer_0.append([])
-                self.map.layer_1.append([])
-                for x in range(0, self.map.size[0]):
-                    ground_types = ['GRASS', 'GROUND', 'GRASS', 'GRASS']
-                    layer_types = ['UI_EMPTY', 'UI_EMPTY', 'UI_EMPTY', 'TREE S']
-                    number = random.randint(0, 3)
-                    number2 = random.randint(0, 3)
-                    self.map.layer_0[y].append(ground_types[number])
-                    self.map.layer_1[y].append(layer_types[number2])
-        except Exception, e:
-            print "Failed at ({},{}) with max dimensions ({},{})".format(x, y, self.map.size[0], self.map.size[1])
-            return None
+        self.map.clear()
+        for y in range(0, self.map.size[1]):
+            for x in range(0, self.map.size[0]):
+                ground_types = ['GRASS', 'GROUND', 'GRASS', 'GRASS']
+                layer_types = ['UI_EMPTY', 'UI_EMPTY', 'UI_EMPTY', 'TREES']
+                number = random.randint(0, 3)
+                number2 = random.randint(0, 3)
+                self.map.layers['layer_0'][y, x] = TILE_IDS[ground_types[number]]
+                self.map.layers['layer_1'][y, x] = TILE_IDS[layer_types[number2]]
 
     def gen_island(self):
         """Generates an island map."""
-        while True:
-            print "Generating Island"
-            surface = MainGenerator().gen_island(self.scale, self.rainfall)
-            self.gen_from_image(surface, surface.get_size())
-
-            if self.gen_playable_elements(surface):
-                return
+        self.generate("Island", lambda generator: generator.gen_island(self.scale, self.rainfall))
 
     def gen_continents(self):
-        while True:
-            print "Generating Continent"
-            surface = MainGenerator().gen_continents(self.scale, self.rainfall)
-            self.gen_from_image(surface, surface.get_size())
-
-            if self.gen_playable_elements(surface):
-                return
-
+        self.generate("Continent", lambda generator: generator.gen_continents(self.scale, self.rainfall))
 
     def gen_highlands(self):
-        while True:
-            print "Generating Highlands"
-            surface = MainGenerator().gen_highlands(self.scale, self.rainfall)
-            self.gen_from_image(surface, surface.get_size())
+        self.generate("Highlands", lambda generator: generator.gen_highlands(self.scale, self.rainfall))
+
+    def generate(self, name, gen_heightfield):
+        """Generates the terrain and then the playable elements, up to MAX_ATTEMPTS times. The cheap retries, looking
+        for the start location on every playable island and then with a relaxed footprint, happen within each
+        attempt, so the terrain is only thrown away once none of them work. Each attempt is logged on the map with
+        how long it took and why it failed, and a GenerationError is raised once the budget runs out."""
+        self.map.generation_log = []
+
+        while self.attempt < MAX_ATTEMPTS:
+            started = time.time()
+            generator = self.begin_attempt()
+            print "Generating {} (seed {}, attempt {})".format(name, self.seed, self.attempt)
+            heightfield = gen_heightfield(generator)
+            self.gen_from_image(heightfield, heightfield.get_size())
+
+            success = self.gen_playable_elements(heightfield)
+            if success:
+                reason = None
+            elif len(self.map.playable_islands) == 0:
+                reason = "no islands large enough to play on"
+            else:
+                reason = "no room for a start location on {} playable islands".format(len(self.map.playable_islands))
 
-            if self.gen_playable_elements(surface):
+            self.map.generation_log.append({'attempt': self.attempt, 'time': time.time() - started, 'reason': reason})
+            if success:
+                self.decorations = self.decorate(heightfield)
+                if not self.stream:
+                    self.finish()
                 return
+            print "Attempt {} failed after {:.2f}s: {}".format(self.attempt, time.time() - started, reason)
 
-    def gen_from_image(self, surface, max_size):
-        """"Generates a map from an image. All generators will generate an image which will then be passed into
-        This function to generate the playable map."""
-        size = surface.get_size()
+        raise GenerationError("No playable {} map after {} attempts (seed {}): {}".format(
+            name.lower(), self.attempt, self.seed, reason))
+
+    def gen_from_image(self, heightfield, max_size):
+        """"Generates a map from a heightfield. All generators will generate a heightfield which will then be passed
+        into This function to generate the playable map."""
+        rng = self.streams['terrain']
+        size = heightfield.get_size()
         dimensions = (0, 0)
 
         # if it is wider than tall...
@@ -392,44 +491,17 @@ class GameMapGenerator:
             scale = float(max_size[1]) / float(size[1])
             dimensions = (int(round(float(size[0]) * scale)), max_size[1])
 
-        surface = pygame.transform.smoothscale(surface, dimensions)
+        heightfield = heightfield.resized(dimensions)
 
         self.map.set_size(dimensions)
 
         self.gen_empty()
+        layer_0, layer_1 = self.map.layers['layer_0'], self.map.layers['layer_1']
 
-        for x in range(self.map.size[0]):
-            for y in range(self.map.size[1]):
-                red, green, blue, alpha = surface.get_at((x, y))
-                average = (red + green + blue) / 3
-
-                tile = 'GRASS'
-                if average < 50:
-                    tile = 'OCEAN'
-                elif average < 100:
-                    tile = 'SHORE'
-                # if desert type, all higher tiles should be sand
-                elif self.map_type == "deserts":
-                    tile = 'SAND'
-                elif average < 200:
-                    tile = 'GRASS'
-                elif average < 230:
-                    tile = 'GROUND'
-                else:
-                    tile = 'SNOW'
-
-                self.map.layer_0[y][x] = tile
-
-                # 2.5% chance of high elevation tiles generating a mountain
-                if tile in ['GROUND', 'SNOW'] and random.randint(0,40) == 0:
-                    self.map.layer_1[y][x] = 'MOUNTAIN'
+        gen_terrain(heightfield.data, layer_0, layer_1, self.map_type, rng)
+        self.reserved = np.zeros(layer_0.shape, dtype=bool)
 
-                # 2% chance of desert tiles generating a palm tree
-                if tile in ['SAND'] and random.randint(0,50) == 0:
-                    self.map.layer_1[y][x] = 'PALMTREE'
-
-
-    def gen_playable_elements(self, surface):
+    def gen_playable_elements(self, heightfield):
         # Define the islands
         if self.map_type not in ['deserts','highlands']:
             self.gen_beaches()
@@ -440,129 +512,99 @@ class GameMapGenerator:
             self.define_landmass()
         else:
             self.define_islands()
-        # Generate rivers
-        self.gen_rivers(surface)
-        # Generate forests
-        if self.map_type != 'deserts':
-            self.gen_forests()
-        # Generate ore veins
-        self.gen_ore_veins()
-        # Select player startpoint on the largest island
+        # Select player startpoint on the largest island, trying the smaller islands and then a relaxed footprint
+        # before the terrain has to be generated again. The start location is picked before the map is decorated, so
+        # that the game can begin as soon as it is known.
         islands_to_test = sorted(self.map.playable_islands, key=len)
         islands_to_test.reverse()
 
-        for island in islands_to_test:
-            if self.select_player_startpoint(island):
-                return True
+        for footprint in [START_FOOTPRINT, RELAXED_START_FOOTPRINT]:
+            for island in islands_to_test:
+                if self.select_player_startpoint(island, footprint):
+                    return True
         return False
 
+    def decorate(self, heightfield):
+        """Adds the rivers, forests and ore veins to the map, yielding the name of each stage once it is done. None
+        of them are placed on the tiles reserved for the start location."""
+        self.gen_rivers(heightfield)
+        yield 'rivers'
+        if self.map_type != 'deserts':
+            self.gen_forests()
+            yield 'forests'
+        self.gen_ore_veins()
+        yield 'ores'
+
+    def step(self):
+        """Runs the next decoration stage. Returns whether the map is finished."""
+        return next(self.decorations, None) is None
+
+    def finish(self):
+        """Runs all of the decoration stages still to run."""
+        for stage in self.decorations:
+            pass
+
+    def is_reserved(self, loc):
+        """Checks whether a location is on the map and kept clear for the start location."""
+        x, y = loc
+        return 0 <= x < self.map.size[0] and 0 <= y < self.map.size[1] and bool(self.reserved[y, x])
+
     # Search and define islands
     def define_islands(self):
         """Explores a map and builds an array of islands it discovers."""
-        # Change the recursion limit to permit the scanning of the map
-        sys.setrecursionlimit(20000)
+        passable = ~self.map.is_impassable[self.map.layers['layer_0']]
 
-        # A list of all the islands (continuous landmasses) and the tiles that we've already visted
-        islands = []
-        visited_tiles = []
+        # Label every continuous landmass, numbered in the order a row by row scan of the map reaches them
+        labels, count = label_regions(passable)
+        islands = zip(range(1, count + 1), region_tiles(labels, count))
 
-        for y in range(0, self.map.size[1]):
-            for x in range(0, self.map.size[0]):
-                # If we've already logged this tile, skip it
-                if (x, y) in visited_tiles:
-                    continue
+        islands = sorted(islands, key=lambda island: len(island[1]))
+        islands.reverse()
+        self.map.islands = [tiles for label, tiles in islands]
 
-                if self.map.get((x, y))['layer_0'] not in self.map.impassable:
-                    island_tiles = []
-                    self.find_island_boundaries(visited_tiles, island_tiles, (x, y))
-                    # sort tiles by axes
-                    island_tiles = sorted(island_tiles, key=lambda x: (x[1], -x[0]))
-                    islands.append(island_tiles)
-        self.map.islands = sorted(islands, key=len)
-        self.map.islands.reverse()
+        # Renumber the labels so that label i + 1 is the island at self.map.islands[i]
+        relabel = np.zeros(count + 1, dtype=np.int32)
+        for i, (label, tiles) in enumerate(islands):
+            relabel[label] = i + 1
+        self.map.island_labels = relabel[labels]
 
         # Player doesn't necessarily have to start on the biggest island, but prevent them starting on an island too
         # small to be properly playable
         self.map.playable_islands = [x for x in self.map.islands if len(x) > 400]
 
-        # Return the recursion limit to normal value
-        sys.setrecursionlimit(1000)
-
-        # Search and define islands
-
     def define_landmass(self):
         """Defines the map as a single landmass. For use only with the highlands map type."""
-        island = []
-
-        for y in range(0, self.map.size[1]):
-            for x in range(0, self.map.size[0]):
-                if self.map.get((x,y))['layer_0'] not in self.map.impassable:
-                    island.append((x,y))
+        passable = ~self.map.is_impassable[self.map.layers['layer_0']]
+        ys, xs = np.nonzero(passable)
+        island = zip(xs.tolist(), ys.tolist())
 
         self.map.islands = [island]
         self.map.playable_islands = [island]
-
-    def find_island_boundaries(self, visited_tiles, island_tiles, loc):
-        """Walks around the map exploring an island to discover its boundaries."""
-        x, y = loc
-        # Quit if we've already logged this tile
-        if loc in visited_tiles:
-            return
-        visited_tiles.append(loc)
-
-        # Quit if the tile is water or ice
-        if self.map.get(loc)['layer_0'] in self.map.impassable:
-            return
-
-        # Quit if we've already logged this tile in this current island (failsafe)
-        if loc in island_tiles:
-            return
-        island_tiles.append(loc)
-
-        # Spread out recursively and find all the tiles that we can
-        if x > 0:
-            if self.map.get((x - 1, y))['layer_0'] not in self.map.impassable and (x - 1, y) not in visited_tiles:
-                self.find_island_boundaries(visited_tiles, island_tiles, (x - 1, y))
-        if x < self.map.size[0] - 1:
-            if self.map.get((x + 1, y))['layer_0'] not in self.map.impassable and (x + 1, y) not in visited_tiles:
-                self.find_island_boundaries(visited_tiles, island_tiles, (x + 1, y))
-
-        if y > 0:
-            if self.map.get((x, y - 1))['layer_0'] not in self.map.impassable and (x, y - 1) not in visited_tiles:
-                self.find_island_boundaries(visited_tiles, island_tiles, (x, y - 1))
-        if y < self.map.size[0] - 1:
-            if self.map.get((x, y + 1))['layer_0'] not in self.map.impassable and (x, y + 1) not in visited_tiles:
-                self.find_island_boundaries(visited_tiles, island_tiles, (x, y + 1))
+        self.map.island_labels = passable.astype(np.int32)
 
     def find_island_min_max(self, island):
         """Function to find the upper left corner and lower right corner of an islands occupied rectangle.
         NOTE: This may overlap other islands!"""
-        min_x, max_x = (0, 0)
-        min_y, max_y = (0, 0)
-
-        for tile in island:
-            if tile[0] < min_x:
-                min_x = tile[0]
-            if tile[0] > max_x:
-                max_x = tile[0]
-            if tile[1] < min_y:
-                min_y = tile[1]
-            if tile[1] > max_y:
-                max_y = tile[1]
-
-        return ((min_x, max_x),(min_y,max_y))
+        xs, ys = np.array(island).T
+        return ((int(xs.min()), int(xs.max())), (int(ys.min()), int(ys.max())))
 
     def find_island_midpoint(self, island):
-        min_x, max_x, min_y, max_y = self.find_island_midpoint(island)
+        (min_x, max_x), (min_y, max_y) = self.find_island_min_max(island)
 
         return ((min_x + max_x)/2, (min_y + max_y)/2)
 
     # River generation
-    def gen_rivers(self, surface):
-        """Generates rivers on the map, using the surface heights as a basis."""
+    def gen_rivers(self, heightfield):
+        """Generates rivers on the map, using the heightfield as a basis. Rivers rise in the highlands of each island
+        and follow the flow network of the heightfield down to the sea, or until they join another river or reach the
+        start location."""
+        rng = self.streams['rivers']
         if len(self.map.islands) == 0:
             self.define_islands()
 
+        water = self.map.is_impassable[self.map.layers['layer_0']]
+        network = FlowNetwork(heightfield.data, water)
+
         for island in self.map.islands:
             if len(island) < 40:
                 continue
@@ -572,26 +614,40 @@ class GameMapGenerator:
             # calculate a maximum number of rivers
             i_max = max(i_min + 3, int(len(island) ** (1. / 3)))
 
-            rivers_count = random.randint(i_min, i_max) + (self.rainfall - 1)
+            rivers_count = rng.randint(i_min, i_max) + (self.rainfall - 1)
+
+            # rivers rise from the upper part of the island, and more often where more water collects
+            xs, ys = np.array(island).T
+            heights = heightfield.data[ys, xs]
+            band = np.argsort(heights, kind='mergesort')[int(len(island) * 0.85):int(len(island) * 0.98) + 1]
+            weights = np.cumsum(network.accumulation[ys[band], xs[band]])
 
-            height_values = [{'value': self.averageRGB(surface.get_at(x)), 'loc': x} for x in island]
-            height_values = sorted(height_values, key=lambda x: x['value'])
+            # give up on the island once a river has failed to be placed a few times over
+            attempts = rivers_count * 4
+            while rivers_count > 0 and attempts > 0:
+                attempts -= 1
+                source = band[np.searchsorted(weights, rng.random() * weights[-1], side='right')]
 
-            while rivers_count > 0:
-                start_point = \
-                height_values[random.randint(int(len(height_values) * 0.85), int(len(height_values) * 0.98))]['loc']
+                rivers = (self.map.layers['layer_1'] == TILE_IDS['RIVER']) | self.reserved
+                limit = rng.randint(10, 26) if self.map_type == 'highlands' else None
+                river_set, mouth = network.trace((int(xs[source]), int(ys[source])), rivers, limit)
+                if len(river_set) == 0:
+                    continue
+                rivers_count -= 1
+                x, y = river_set[-1]
 
-                river_set = []
-                if self.draw_river(surface, start_point, river_set):
-                    rivers_count -= 1
+                # perform meandering
+                river_set = self.meander_river(river_set)
 
-                    # perform meandering
-                    river_set = self.meander_river(river_set)
+                # widen the river into a small delta where it meets the sea
+                if mouth >= 0:
+                    for loc in [(x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)]:
+                        if self.map.get_id(loc, 'layer_0') not in [None, TILE_IDS['OCEAN'], TILE_IDS['SHORE']]:
+                            river_set.append(loc)
 
-                    for loc in river_set:
+                for loc in river_set:
+                    if not self.is_reserved(loc):
                         self.map.set(loc, 'layer_1', 'RIVER')
-                else:
-                    river_set = []
 
     def meander_river(self, river_set):
         """Takes a river set and adds a manual meander for aesthetic purposes"""
@@ -640,85 +696,24 @@ class GameMapGenerator:
                         last_dir = dir
 
                 count += 1
-            return river_set
-
-    def draw_river(self, surface, loc, river_set, weight=1):
-
-        # Get the location and ensure it's within boundaries
-        x, y = loc
-        if x < 0 or y < 0 or x > self.map.size[0] - 1 or y > self.map.size[1] - 1:
-            return False
-
-        if self.map.get(loc)['layer_1'] == 'RIVER' or loc in river_set:
-            return False
-
-        river_set.append(loc)
-
-        current_val = self.averageRGB(surface.get_at(loc))
-
-        possible_dirs = []
-
-        up = 127.5 if y == 0 else self.averageRGB(surface.get_at((x, y - 1)))
-        down = 127.5 if y == self.map.size[1] - 1 else self.averageRGB(surface.get_at((x, y + 1)))
-        left = 127.5 if x == 0 else self.averageRGB(surface.get_at((x - 1, y)))
-        right = 127.5 if x == self.map.size[0] - 1 else self.averageRGB(surface.get_at((x + 1, y)))
-
-        if y > 0 and up <= current_val:
-            possible_dirs.append({'dir': 'up', 'value': up})
-        if y < self.map.size[1] - 1 and down <= current_val:
-            possible_dirs.append({'dir': 'down', 'value': down})
-        if x > 0 and left <= current_val:
-            possible_dirs.append({'dir': 'left', 'value': left})
-        if x < self.map.size[0] - 1 and right <= current_val:
-            possible_dirs.append({'dir': 'right', 'value': right})
-
-        if len(possible_dirs) == 0:
-            return False
-
-        possible_dirs = sorted(possible_dirs, key=lambda x: x['value'])
-
-        # 25% chance of river splitting into multiple directions
-        if random.randint(1, 4) < 4:
-            # prefer the second lowest value to encourage meandering
-            if len(possible_dirs) > 1:
-                dir = possible_dirs[-2]['dir']
-            else:
-                dir = possible_dirs[0]['dir']
-
-        for dir in possible_dirs:
-            if dir['dir'] == 'up':
-                loc = (x, y - 1)
-            elif dir['dir'] == 'down':
-                loc = (x, y + 1)
-            elif dir['dir'] == 'left':
-                loc = (x - 1, y)
-            elif dir['dir'] == 'right':
-                loc = (x + 1, y)
-
-            if self.map.get(loc)['layer_0'] == 'SHORE' or self.map.get(loc)['layer_0'] == 'OCEAN':
-                if weight > 0:
-                    # generate some river deltas if possible
-                    if x > 0 and self.map.get((x - 1, y))['layer_0'] not in self.map.impassable:
-                        self.draw_river(surface, (x - 1, y), river_set, weight-1)
-                    if x < self.map.size[0] - 1 and self.map.get((x + 1, y))['layer_0'] not in self.map.impassable:
-                        self.draw_river(surface, (x + 1, y), river_set, weight-1)
-                    if y > 0 and self.map.get((x, y - 1))['layer_0'] not in self.map.impassable:
-                        self.draw_river(surface, (x, y - 1), river_set, weight-1)
-                    if y < self.map.size[1] - 1 and self.map.get((x, y + 1))['layer_0'] not in self.map.impassable:
-                        self.draw_river(surface, (x, y + 1), river_set, weight-1)
-
-                # success!
-                return True
-            elif self.map_type == 'highlands' and len(river_set) > random.randint(10,26):
-                return True
-            return self.draw_river(surface, loc, river_set)
+        return river_set
 
     # Forest generation
     def gen_forests(self):
-        """Generates forests on the larger islands of the map."""
+        """Generates forests on the larger islands of the map. Forests can only grow on grass which is free, and the
+        seed of every forest on an island is picked from that grass with a single draw."""
+        rng = self.streams['forests']
         if len(self.map.islands) == 0:
             self.define_islands()
 
+        layer_0, layer_1 = self.map.layers['layer_0'], self.map.layers['layer_1']
+        grass = (layer_0 == TILE_IDS['GRASS']) & ((layer_1 == TILE_IDS['UI_EMPTY']) | (layer_1 == TILE_IDS['TREES']))
+        grass &= ~self.reserved
+
+        # How many times each tile has been grown out of in each direction
+        visits = np.zeros((len(GROWTH_STEPS),) + layer_0.shape, dtype=np.uint8)
+        draws = np.random.RandomState(rng.randint(0, 2 ** 32 - 1))
+
         for island in self.map.islands:
             if len(island) < 30:
                 continue
@@ -729,77 +724,59 @@ class GameMapGenerator:
             i_max = max(i_min + 2, int(len(island)**(1./3.) * 1.5))
 
             # Calculate the number of times to iterate, modified by the rainfall parameter
-            forest_count = random.randint(i_min, i_max) + (self.rainfall - 1)*3
-
-            counted_tiles = []
-            while forest_count > 0:
-                # pick a random start point on the island
-                loc = island[random.randint(0, len(island) - 1)]
+            forest_count = rng.randint(i_min, i_max) + (self.rainfall - 1)*3
 
-                # keep a list of tiles we've visited
-                if loc in counted_tiles:
-                    continue
-                # forests can only start on grass
-                if self.map.get(loc)['layer_0'] != 'GRASS':
-                    counted_tiles.append(loc)
-                    continue
-                # if counted every tile on the island and there's no grass, exit
-                if len(counted_tiles) >= len(island):
-                    break
+            xs, ys = np.array(island).T
+            candidates = np.flatnonzero(grass[ys, xs])
+            if forest_count <= 0 or len(candidates) == 0:
+                continue
 
-                self.grow_trees(loc, 'up', random.randint(8, 12) + self.rainfall)
-                self.grow_trees(loc, 'down', random.randint(8, 12) + self.rainfall)
-                self.grow_trees(loc, 'left', random.randint(8, 12) + self.rainfall)
-                self.grow_trees(loc, 'right', random.randint(8, 12) + self.rainfall)
-                forest_count -= 1
+            for seed in candidates[draws.randint(0, len(candidates), forest_count)].tolist():
+                loc = (int(xs[seed]), int(ys[seed]))
+                for direction in range(len(GROWTH_STEPS)):
+                    self.grow_trees(loc, direction, rng.randint(8, 12) + self.rainfall, grass, visits)
+
+        # the trees are planted straight into the layer, so draw the whole map again
+        self.map.redraw = True
+
+    def grow_trees(self, loc, direction, weight, grass, visits):
+        """Part of the forest generation. Grows a branch of a forest in a given direction, an index of GROWTH_STEPS,
+        planting trees on the grass mask. Each tree can branch out again with one less weight, up to twice, working
+        through the branches with a queue, until they run out of weight or grass, or reach a tile which has already
+        been grown out of GROWTH_VISITS times going the same way."""
+        rng = self.streams['forests']
+        layer_1 = self.map.layers['layer_1']
+        h, w = grass.shape
+
+        queue = [(loc[0], loc[1], direction, weight)]
+        while queue:
+            x, y, direction, weight = queue.pop()
+            if x < 0 or y < 0 or x >= w or y >= h or not grass[y, x] or visits[direction, y, x] >= GROWTH_VISITS:
+                continue
 
-    def grow_trees(self, loc, direction, weight):
-        """Part of the forest generation. Grows a branch of a forest in a given direction."""
+            layer_1[y, x] = TILE_IDS['TREES']
+            visits[direction, y, x] += 1
+            if weight <= 1:
+                continue
 
-        # Get the location and ensure it's within boundaries
-        x, y = loc
-        if x < 0 or y < 0 or x > self.map.size[0] - 1 or y > self.map.size[1] - 1:
-            return
-
-        # trees should only grow on grass, not sand or other land types
-        tile = self.map.get(loc)
-        if tile['layer_0'] != 'GRASS' or tile['layer_1'] not in ['UI_EMPTY', 'TREES']:
-            return
-
-        self.map.set(loc, 'layer_1', 'TREES')
-
-        if weight == 1:
-            return
-
-        new_direction = direction
-        # prefer for the branches to spread in the same direction, but give it a small chance of making a 90deg turn
-        # in either direction
-        for i in range(1, random.randint(1, 3)):
-            if random.randint(1, 3) > 2:
-                if direction == 'up':
-                    new_direction = ['left', 'right'][random.randint(0, 1)]
-                elif direction == 'down':
-                    new_direction = ['left', 'right'][random.randint(0, 1)]
-                elif direction == 'left':
-                    new_direction = ['up', 'down'][random.randint(0, 1)]
-                elif direction == 'right':
-                    new_direction = ['up', 'down'][random.randint(0, 1)]
-
-            # recursively call the grow function
-            if new_direction == 'up':
-                self.grow_trees((loc[0], loc[1] - 1), new_direction, weight - 1)
-            if new_direction == 'down':
-                self.grow_trees((loc[0], loc[1] + 1), new_direction, weight - 1)
-            if new_direction == 'left':
-                self.grow_trees((loc[0] - 1, loc[1]), new_direction, weight - 1)
-            if new_direction == 'right':
-                self.grow_trees((loc[0] + 1, loc[1]), new_direction, weight - 1)
+            # prefer for the branches to spread in the same direction, but give it a small chance of making a 90deg
+            # turn in either direction
+            for i in range(1, rng.randint(1, 3)):
+                if rng.randint(1, 3) > 2:
+                    direction = GROWTH_TURNS[direction][rng.randint(0, 1)]
+                step_x, step_y = GROWTH_STEPS[direction]
+                queue.append((x + step_x, y + step_y, direction, weight - 1))
 
     # Ores generation
     def gen_ore_veins(self):
+        """Generates coal veins and oil fields on the larger islands of the map. The footprints of all of the veins are
+        grown together by grow_veins and stamped onto the ground in a single update, and the number of ore tiles on
+        each island is counted into self.map.ore_counts."""
+        rng = self.streams['ores']
         if len(self.map.islands) == 0:
             self.define_islands()
 
+        origins, ores, weights = [], [], []
         for island in self.map.islands:
             if len(island) < 30:
                 continue
@@ -810,189 +787,154 @@ class GameMapGenerator:
             i_max += (self.resources - 1)
 
             for i in range(i_min, i_max):
-                coords = island[random.randint(0, len(island)-1)]
+                origins.append(island[rng.randint(0, len(island)-1)])
 
                 # 2/3 chance for coal, 1/3 for oil
-                if random.randint(0,2) > 0:
-                    self.gen_coal_veins(coords,random.randint(4,8))
+                if rng.randint(0,2) > 0:
+                    ores.append(COAL)
+                    weights.append(rng.randint(4,8))
                 else:
-                    self.gen_oil_field(coords,random.randint(2,3))
-
-    def gen_coal_veins(self, loc, weight=4):
-        if weight < 0:
-            return
-
-        tile = self.map.get(loc)
-        if tile == None:
-            return
-        tile_0 = tile['layer_0']
-
-        if tile_0== 'GRASS':
-            self.map.set(loc, 'layer_0', 'GRASSCOAL')
-        elif tile_0 == 'SAND':
-            self.map.set(loc, 'layer_0', 'SANDCOAL')
-        elif tile_0 == 'GROUND':
-            self.map.set(loc, 'layer_0', 'GROUNDCOAL')
-        elif tile_0 in self.map.coal:
-            pass
-        else:
-            return
-
-        # coal veins should draw in a roughly diagonal line
-        self.gen_coal_veins((loc[0]-(random.randint(0,1)),loc[1]-(random.randint(0,1))), weight-1)
-        self.gen_coal_veins((loc[0]+(random.randint(0,1)),loc[1]+(random.randint(0,1))), weight-1)
-
-    def gen_oil_field(self, loc, weight=3):
-        if weight < 0:
-            return
-
-        tile = self.map.get(loc)
-        if tile == None:
-            return
-
-        tile_0 = tile['layer_0']
-
-        if tile_0== 'GRASS':
-            self.map.set(loc, 'layer_0', 'GRASSOIL')
-        elif tile_0 == 'SAND':
-            self.map.set(loc, 'layer_0', 'SANDOIL')
-        elif tile_0 == 'GROUND':
-            self.map.set(loc, 'layer_0', 'GROUNDOIL')
-        elif tile_0 == 'SHORE':
-            self.map.set(loc,'layer_0', 'WATEROIL')
-        elif tile_0 in self.map.oil:
-            pass
-        else:
-            return
-
-        if random.randint(0,1) == 1:
-            self.gen_oil_field((loc[0] - 2, loc[1] - 2), weight-1)
-        if random.randint(0,1) == 1:
-            self.gen_oil_field((loc[0] - 2, loc[1] + 2), weight-1)
-        if random.randint(0,1) == 1:
-            self.gen_oil_field((loc[0] + 2, loc[1] - 2), weight-1)
-        if random.randint(0,1) == 1:
-            self.gen_oil_field((loc[0] + 2, loc[1] + 2), weight-1)
+                    ores.append(OIL)
+                    weights.append(rng.randint(2,3))
+
+        if origins:
+            draws = np.random.RandomState(rng.randint(0, 2 ** 32 - 1))
+            cells, cell_ores = self.grow_veins(np.array(origins), np.array(ores), np.array(weights), draws)
+
+            layer_0 = self.map.layers['layer_0']
+            layer_0.flat[cells] = ORE_TABLE[cell_ores, layer_0.flat[cells]]
+
+            # rivers no longer join up with the shore where oil has been found in it
+            self.map.rebuild_links()
+            self.map.redraw = True
+
+        self.map.ore_counts = count_ores(self.map)
+        print "Placed {} coal and {} oil tiles".format(*self.map.ore_counts.sum(axis=0))
+
+    def grow_veins(self, origins, ores, weights, draws):
+        """Grows the footprints of a batch of ore veins, given the (x, y) origin, ore and weight of each. Returns the
+        flat index of every tile covered and the ore it gets, where each tile is only listed once and goes to the last
+        vein to cover it.
+
+        All of the veins grow together a step at a time, with each tile they reach branching out again with one less
+        weight. Coal branches twice, up and to the left and down and to the right by up to a tile each way, so that it
+        draws a roughly diagonal line, and oil spreads by OIL_STEPS. A branch stops at the edge of the map, at ground
+        which can't hold its ore and at the tiles reserved for the start location, and where branches of a vein meet
+        only VEIN_BRANCHES of them carry on."""
+        layer_0 = self.map.layers['layer_0']
+        h, w = layer_0.shape
+        holds = (ORE_TABLE[:, layer_0.ravel()] >= 0) & ~self.reserved.ravel()
+
+        veins = np.arange(len(origins))
+        xs, ys = origins[:, 0], origins[:, 1]
+        covered_cells, covered_veins = [], []
+
+        while len(veins):
+            inside = (xs >= 0) & (ys >= 0) & (xs < w) & (ys < h)
+            veins, cells, weights = veins[inside], ys[inside] * w + xs[inside], weights[inside]
+
+            keep = holds[ores[veins], cells]
+            veins, cells, weights = veins[keep], cells[keep], weights[keep]
+            covered_cells.append(cells)
+            covered_veins.append(veins)
+
+            # only the first few branches of a vein to reach each tile carry on
+            keys = veins.astype(np.int64) * (w * h) + cells
+            order = np.argsort(keys, kind='mergesort')
+            keys, index = keys[order], np.arange(len(keys))
+            ranks = index - np.maximum.accumulate(np.where(np.r_[True, keys[1:] != keys[:-1]], index, 0))
+            order = order[ranks < VEIN_BRANCHES]
+            veins, cells, weights = veins[order], cells[order], weights[order]
+
+            growing = weights > 0
+            veins, cells, weights = veins[growing], cells[growing], weights[growing] - 1
+            xs, ys = cells % w, cells // w
+            steps = draws.randint(0, 2, (4, len(veins)))
+
+            coal = ores[veins] == COAL
+            branches = [(veins[coal], xs[coal] - steps[0][coal], ys[coal] - steps[1][coal], weights[coal]),
+                        (veins[coal], xs[coal] + steps[2][coal], ys[coal] + steps[3][coal], weights[coal])]
+            for (step_x, step_y), taken in zip(OIL_STEPS, steps.astype(bool)):
+                spread = ~coal & taken
+                branches.append((veins[spread], xs[spread] + step_x, ys[spread] + step_y, weights[spread]))
+            veins, xs, ys, weights = [np.concatenate(parts) for parts in zip(*branches)]
+
+        # where veins overlap the later one wins, as it would have been stamped over the earlier one
+        cells, veins = np.concatenate(covered_cells), np.concatenate(covered_veins)
+        order = np.argsort(-veins, kind='mergesort')
+        cells, first = np.unique(cells[order], return_index=True)
+        return cells, ores[veins[order][first]]
 
     def gen_beaches(self):
-        new_map = copy.deepcopy(self.map)
-
-        for x in range(0, self.map.size[0]):
-            for y in range(0, self.map.size[1]):
-                tiles, count = (0,0)
-
-                for nx in range(x-1, x+2):
-                    for ny in range(y-1, y+2):
-                        tile_at = self.map.get((nx,ny))
-                        # If the tile is off the map, or it is not water and it is the current tile, do not affect the automata value
-                        if tile_at == None or (tile_at['layer_0'] not in self.map.impassable and nx == x and ny == y):
-                            continue
-
-                        if tile_at['layer_0'] == "OCEAN":
-                            tiles -= 2
-                        elif tile_at['layer_0'] == "SHORE":
-                            tiles -= 1
-                        elif tile_at['layer_0'] not in self.map.impassable:
-                            tiles += 1
-                        count += 1
-
-                if tiles <= -(count/2) and self.map.get((x,y))['layer_0'] != "OCEAN":
-                    new_map.layer_0[y][x] = 'SHORE'
-                if tiles > -(count/2) and tiles < (count/2):
-                    new_map.layer_0[y][x] = 'SAND'
-                    # Add a small chance of adding a palm tree
-                    if random.randint(0,100) < 5:
-                        new_map.layer_1[y][x] = 'PALMTREE'
-
-        self.map.layer_0 = copy.copy(new_map.layer_0)
-        self.map.layer_1 = copy.copy(new_map.layer_1)
-
+        """Turns the land next to the sea into sand and the sea next to the land into shallow shore, scattering a few
+        palm trees along the beaches."""
+        self.map.layers['layer_0'] = gen_beaches(self.map.layers['layer_0'], self.map.layers['layer_1'],
+                                                 self.streams['beaches'])
 
     def gen_snow(self):
-        new_map = copy.deepcopy(self.map)
-
-        for x in range(0, self.map.size[0]):
-            for y in range(0, self.map.size[1]):
-                snow = 0
-                grass = 0
-                ground = 0
-
-                for nx in range(x-1, x+2):
-                    for ny in range(y-1, y+2):
-                        tile_at = self.map.get((nx,ny))
-                        # If the tile is off the map, or it is not water and it is the current tile, do not affect the automata value
-                        if tile_at == None or (tile_at['layer_0'] not in self.map.impassable and nx == x and ny == y):
-                            continue
-                        elif tile_at['layer_0'] == "SNOW":
-                            snow += 1
-                        elif tile_at['layer_0'] == "GROUND":
-                            ground += 1
-                        elif tile_at['layer_0'] == "GRASS":
-                            grass += 1
-
-                # if more than two neighbours are snow, this tile should be snow
-                if snow > 2:
-                    new_map.layer_0[y][x] = 'SNOW'
-                # otherwise, if it is snow and is isolated, clip it
-                elif self.map.get((x,y))['layer_0'] == 'SNOW':
-                    new_map.layer_0[y][x] = "GROUND" if ground > grass else "GRASS"
-
-        self.map.layer_0 = copy.copy(new_map.layer_0)
-        self.map.layer_1 = copy.copy(new_map.layer_1)
-
+        """Grows snow on the tiles surrounded by snow and clips isolated snow back to the surrounding land."""
+        self.map.layers['layer_0'] = gen_snow(self.map.layers['layer_0'])
 
     # Player start location selection
-    def select_player_startpoint(self, island):
-
-        (min_x, max_x), (min_y, max_y) = self.find_island_min_max(island)
-
-        range_x = sorted(range(min_y, max_y), key=lambda k: random.random())
-        range_y = sorted(range(min_x, max_x), key=lambda k: random.random())
-
-        tiles = []
-        start_loc = (-1,-1)
-        for y in range_y:
-            for x in range_x:
-                tiles = self.start_location_suitability((x,y))
-                start_loc = (x,y)
-                break
-            if len(tiles) > 0:
-                break;
-        if len(tiles) > 0:
-            # If we've succeeded in finding a start location
-            self.map.start_loc = start_loc
-            for tile in tiles:
-                # Clear any forests that may be in the way
-                self.map.set(tile, 'layer_1', 'UI_EMPTY')
-
-            # Draw the required tiles for the start location
-            self.map.set(start_loc, 'layer_1', 'MAYORS')
-            self.map.set((start_loc[0]-1,start_loc[1]+1), 'layer_1', 'ROAD')
-            self.map.set((start_loc[0],start_loc[1]+1), 'layer_1', 'ROAD')
-            self.map.set((start_loc[0]+1,start_loc[1]+1), 'layer_1', 'ROAD')
-
-            # Center the map on the player location
-            self.map.pos_at = (max(0,start_loc[0] - config.SCREEN_X / 2), max(0, start_loc[1] - config.SCREEN_Y / 2))
-
-            return True
-        else:
+    def select_player_startpoint(self, island, footprint=START_FOOTPRINT):
+        """Places the town hall and its road on the island. Every location where the footprint fits, clear of water,
+        is found at once with a summed-area table of the blocked tiles. One of them is then picked at random, or the
+        one closest to the middle of the island for the central start placement. The footprint is reserved so that
+        the decoration stages keep clear of it."""
+        rng = self.streams['start']
+        layer_0, layer_1 = self.map.layers['layer_0'], self.map.layers['layer_1']
+        h, w = layer_0.shape
+
+        blocked = self.map.is_impassable[layer_0]
+        table = np.zeros((h + 1, w + 1), dtype=np.int32)
+        table[1:, 1:] = blocked.cumsum(axis=0).cumsum(axis=1)
+
+        # the town hall itself has to be on the island, and only on sand or snow in the deserts
+        xs, ys = np.array(island).T
+        valid = np.zeros((h, w), dtype=bool)
+        valid[ys, xs] = True
+        if self.map_type != "deserts":
+            valid &= (layer_0 != TILE_IDS['SAND']) & (layer_0 != TILE_IDS['SNOW'])
+
+        # count the blocked tiles within the footprint around every location it fits on the map
+        left, right, top, bottom = footprint
+        (min_x, max_x), (min_y, max_y) = (max(0, -left), min(w, w - right)), (max(0, -top), min(h, h - bottom))
+        if min_x >= max_x or min_y >= max_y:
+            return False
+        x0, x1 = slice(min_x + left, max_x + left), slice(min_x + right + 1, max_x + right + 1)
+        y0, y1 = slice(min_y + top, max_y + top), slice(min_y + bottom + 1, max_y + bottom + 1)
+        inside = table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+
+        fits = np.zeros((h, w), dtype=bool)
+        fits[min_y:max_y, min_x:max_x] = inside == 0
+        ys, xs = np.nonzero(valid & fits)
+        if len(xs) == 0:
             return False
 
-    def start_location_suitability(self, loc):
-        current_tile = self.map.get(loc)
-        if current_tile['layer_0'] in self.map.impassable or (self.map_type != "deserts" and current_tile['layer_0'] in ['SAND', 'SNOW']):
-            return []
-
-        tiles = []
-        for y in range(loc[1]-1,loc[1]+2):
-            for x in range(loc[0]-2,loc[0]+3):
-                tile_at = self.map.get((x,y))
-                # if any of the tiles in the required minimum space are
-                if tile_at['layer_0'] in self.map.impassable or tile_at['layer_1'] == 'RIVER':
-                    return []
-                tiles.append((x,y))
-
-        return tiles
+        if self.start_placement == 'central':
+            mid_x, mid_y = np.array(island).mean(axis=0)
+            choice = int(np.argmin((xs - mid_x) ** 2 + (ys - mid_y) ** 2))
+        else:
+            choice = rng.randint(0, len(xs) - 1)
+        start_loc = (int(xs[choice]), int(ys[choice]))
+        self.map.start_loc = start_loc
+
+        # Clear any palms or mountains that may be in the way, and keep the rest of the decoration out
+        area = (slice(start_loc[1] + top, start_loc[1] + bottom + 1),
+                slice(start_loc[0] + left, start_loc[0] + right + 1))
+        layer_1[area] = TILE_IDS['UI_EMPTY']
+        self.reserved[area] = True
+
+        # Draw the required tiles for the start location
+        self.map.set(start_loc, 'layer_1', 'MAYORS')
+        self.map.set((start_loc[0]-1,start_loc[1]+1), 'layer_1', 'ROAD')
+        self.map.set((start_loc[0],start_loc[1]+1), 'layer_1', 'ROAD')
+        self.map.set((start_loc[0]+1,start_loc[1]+1), 'layer_1', 'ROAD')
+
+        # Center the map on the player location
+        self.map.pos_at = (max(0,start_loc[0] - config.SCREEN_X / 2), max(0, start_loc[1] - config.SCREEN_Y / 2))
+
+        return True
 
     # Utility classes
     def averageRGB(self, color):
@@ -0,0 +1,53 @@
+#!/usr/bin/python
+
+import numpy as np
+import pygame
+
+
+class Heightfield:
+    """A grayscale heightmap stored as a 2D float32 array, indexed [y, x]. The generators work on the whole array at
+    once and only convert to or from a pygame.Surface when the map needs to be displayed or saved."""
+    def __init__(self, size, data=None, origin=(0, 0), world_size=None):
+        if data is None:
+            data = np.zeros((size[1], size[0]), dtype=np.float32)
+        self.data = data
+
+        # When the heightfield is one chunk of a larger world, where its top left corner lies in the world and the
+        # size of the whole world, so that masks line up across chunks
+        self.origin = origin
+        self.world_size = world_size
+
+    @classmethod
+    def from_surface(cls, surface):
+        """Builds a heightfield from a surface, averaging the RGB channels into a single height value."""
+        rgb = pygame.surfarray.array3d(surface).astype(np.int32)
+        # surfarray is indexed [x, y], so transpose into the row-major layout used everywhere else
+        average = (rgb[:, :, 0] + rgb[:, :, 1] + rgb[:, :, 2]) // 3
+        return cls(surface.get_size(), np.ascontiguousarray(average.T, dtype=np.float32))
+
+    def to_surface(self):
+        """Renders the heightfield as a grayscale surface."""
+        gray = np.clip(self.data, 0, 255).astype(np.uint8).T
+        return pygame.surfarray.make_surface(np.dstack((gray, gray, gray)))
+
+    def get_size(self):
+        """Returns the (width, height) of the heightfield, matching pygame.Surface.get_size()."""
+        return self.data.shape[1], self.data.shape[0]
+
+    def get_world_size(self):
+        """Returns the (width, height) of the world the heightfield is part of, which is its own size unless it is a
+        chunk."""
+        return self.get_size() if self.world_size is None else self.world_size
+
+    def get(self, loc):
+        """Returns the height at the given (x, y) location as an integer."""
+        return int(self.data[loc[1], loc[0]])
+
+    def copy(self):
+        return Heightfield(self.get_size(), self.data.copy(), self.origin, self.world_size)
+
+    def resized(self, size):
+        """Returns a copy of the heightfield smoothly scaled to the given (width, height)."""
+        if size == self.get_size():
+            return self.copy()
+        return Heightfield.from_surface(pygame.transform.smoothscale(self.to_surface(), size))
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+
+import heapq
+
+import numpy as np
+
+
+class FlowNetwork:
+    """The direction water flows in across every land tile of a heightfield and how much water collects on each tile,
+    found with a priority flood from the sea and the edges of the map. The flood visits the land from the lowest
+    point inwards, filling in any depressions, and every tile drains into the tile it was reached from, so the
+    network always leads down to the sea or off the map and never loops. Building it is O(N log N) in the size of the
+    map."""
+    def __init__(self, heights, water):
+        # Heights and the water mask are indexed [y, x]
+        self.shape = heights.shape
+        self.water = water
+
+        # For each tile as a flat index, the tile it drains into, or -1 for water and tiles draining off the map
+        self.receiver = None
+        # The land tiles in the order the flood reached them, from downstream to upstream
+        self.order = None
+        # The number of tiles draining through each tile, including itself, indexed [y, x]
+        self.accumulation = None
+
+        self.flood(heights)
+        self.accumulate()
+
+    def flood(self, heights):
+        """Runs the priority flood over the heights, finding the tile each land tile drains into."""
+        h, w = self.shape
+        heights = heights.ravel().tolist()
+        visited = self.water.ravel().tolist()
+        receiver = [-1] * (h * w)
+        order = []
+
+        # The flood starts from the land along the coast and along the edges of the map
+        land = ~self.water
+        edge = np.zeros(self.shape, dtype=bool)
+        edge[0, :] = edge[-1, :] = edge[:, 0] = edge[:, -1] = True
+        padded = np.pad(self.water, 1, 'constant')
+        coast = padded[:-2, 1:-1] | padded[2:, 1:-1] | padded[1:-1, :-2] | padded[1:-1, 2:]
+
+        heap = []
+        for i in np.flatnonzero(land & (edge | coast)).tolist():
+            y, x = divmod(i, w)
+            # drain into the sea if there is any next to the tile, otherwise off the edge of the map
+            for n in self.neighbours(i, x, y):
+                if self.water.flat[n]:
+                    receiver[i] = n
+                    break
+            visited[i] = True
+            heap.append((heights[i], i))
+        heapq.heapify(heap)
+
+        # Always expand the lowest tile reached so far. Tiles lower than the tile they are reached from are in a
+        # depression, and are raised to its level so the water runs out over the lowest point of the rim.
+        while heap:
+            level, i = heapq.heappop(heap)
+            order.append(i)
+            y, x = divmod(i, w)
+            for n in self.neighbours(i, x, y):
+                if not visited[n]:
+                    visited[n] = True
+                    receiver[n] = i
+                    heapq.heappush(heap, (max(level, heights[n]), n))
+
+        self.receiver = receiver
+        self.order = order
+
+    def accumulate(self):
+        """Sends a unit of rain from every land tile down the network, upstream tiles first."""
+        receiver = self.receiver
+        water = self.water.ravel().tolist()
+        accumulation = [1] * len(receiver)
+
+        for i in reversed(self.order):
+            n = receiver[i]
+            if n >= 0 and not water[n]:
+                accumulation[n] += accumulation[i]
+
+        self.accumulation = np.array(accumulation, dtype=np.int32).reshape(self.shape)
+
+    def neighbours(self, i, x, y):
+        """Returns the flat indexes of the top, bottom, left and right neighbours of a tile which are on the map."""
+        h, w = self.shape
+        neighbours = []
+        if y > 0:
+            neighbours.append(i - w)
+        if y < h - 1:
+            neighbours.append(i + w)
+        if x > 0:
+            neighbours.append(i - 1)
+        if x < w - 1:
+            neighbours.append(i + 1)
+        return neighbours
+
+    def trace(self, loc, stop=None, limit=None):
+        """Follows the flow of water from the given (x, y) land tile. The path ends on the last land tile before the
+        sea or the edge of the map, before the first tile in the optional stop mask, or after limit tiles. Returns
+        the path as a list of (x, y) tiles and the flat index of the water tile it runs into, or -1 if it doesn't
+        reach the sea."""
+        w = self.shape[1]
+        path = []
+        i = loc[1] * w + loc[0]
+
+        while limit is None or len(path) < limit:
+            y, x = divmod(i, w)
+            if stop is not None and stop[y, x]:
+                break
+            path.append((x, y))
+
+            n = self.receiver[i]
+            if n < 0:
+                break
+            if self.water.flat[n]:
+                return path, n
+            i = n
+
+        return path, -1
@@ -9,13 +9,22 @@ import sys
 import math
 import random
 
+import numpy as np
 import pygame
 
 import config
 import generators
+import mapcache
+import mapfile
+
+from tiles import TILES, TILE_IDS, TILE_NAMES, IMPASSABLE, tile_table, autotile_table
+from tiles import LINK_TOP, LINK_BOTTOM, LINK_LEFT, LINK_RIGHT
 
 from ui import Purchasable
 
+# How far away a road can be from a building, across and down
+ROAD_REACH = 2
+
 
 class Tileset:
     def __init__(self, filePath):
@@ -31,86 +40,10 @@ class Tileset:
                             config.TILE_H, config.TILE_W, config.TILE_H)
                     self.table.append(image.subsurface(rect))
 
-            self.tile_types = {
-                'GROUND': 0,
-                'GRASS': 1,
-                'SAND': 2,
-                'SHORE': 3,
-                'OCEAN': 4,
-                'SNOW': 6,
-
-                # resources
-                'GROUNDCOAL': 8,
-                'GRASSCOAL': 9,
-                'SANDCOAL': 10,
-
-                'GROUNDOIL': 6,
-                'GRASSOIL': 7,
-                'SANDOIL': 14,
-                'WATEROIL': 15,
-
-                # items
-                'PALMTREE': 11,
-                'TREES': 12,
-                'MOUNTAIN': 13,
-
-                'ROAD': 31,
-                # road directions
-                'ROAD_0': 16,
-                'ROAD_1': 17,
-                'ROAD_2': 18,
-                'ROAD_3': 19,
-                'ROAD_4': 20,
-                'ROAD_5': 21,
-                'ROAD_6': 22,
-                'ROAD_7': 23,
-                'ROAD_8': 24,
-                'ROAD_9': 25,
-                'ROAD_10': 26,
-                'ROAD_11': 27,
-                'ROAD_12': 28,
-                'ROAD_13': 29,
-                'ROAD_14': 30,
-
-                'RIVER': 47,
-                # water directions
-                'RIVER_0': 32,
-                'RIVER_1': 33,
-                'RIVER_2': 34,
-                'RIVER_3': 35,
-                'RIVER_4': 36,
-                'RIVER_5': 37,
-                'RIVER_6': 38,
-                'RIVER_7': 39,
-                'RIVER_8': 40,
-                'RIVER_9': 41,
-                'RIVER_10': 42,
-                'RIVER_11': 43,
-                'RIVER_12': 44,
-                'RIVER_13': 45,
-                'RIVER_14': 46,
-
-                # buildings
-                'HOUSE': 48,
-                'BIGHOUSE': 49,
-                'APARTMENTS': 50,
-                'STORE': 51,
-                'BIGSTORE': 52,
-                'POLICE': 53,
-                'FIRE': 54,
-                'MAYORS': 55,
-                'MINE': 56,
-                'OILRIG': 57,
-                'FERRY': 58,
-
-                # UI
-                'UI_EMPTY': 59,
-                'CURSOR': 61,
-                'UI_LOCKED': 62,
-                'BULLDOZER': 63
-
-            }
+            self.tile_types = dict(TILES)
 
+            # The image for every tile ID, for drawing straight from the map layers
+            self.images = [self.table[image] for name, image in TILES]
 
         except Exception, e:
             print "Failed to load tilemap: {}".format(e)
@@ -122,16 +55,28 @@ class Tileset:
         else:
             return None
 
+    def get_id(self, tile_id):
+        """Returns the image for a tile ID."""
+        return self.images[tile_id]
+
 
 class Map:
-    def __init__(self, tileset, dim, data):
+    def __init__(self, tileset, dim, data, payload=None, stream=False):
 
         # Initial setup of variables
         self.size = (0, 0)
         self.max_pos = (0, 0)
-        self.visible_tiles = []
         self.tile_at = None
 
+        # The map as last drawn, the position it was drawn from and the tiles which have changed since
+        self.canvas = None
+        self.canvas_pos = (0, 0)
+        self.dirty_tiles = set()
+        self.redraw = True
+
+        # Where the cursor was drawn on the screen last frame
+        self.cursor_rect = None
+
         # The current top-left corner position of the viewfinder, i.e. where to draw the map from
         self.start_pos = (0, 0)
         self.pos_at = [0, 0]
@@ -150,25 +95,97 @@ class Map:
         self.destroy = False
 
         # The tiles which it is not possible to place objects on
-        self.impassable = ['OCEAN', 'SHORE', 'ICE']
+        self.impassable = list(IMPASSABLE)
 
         # Modified ores
         self.coal = ['GROUNDCOAL', 'GRASSCOAL', 'SANDCOAL']
         self.oil = ['GROUNDOIL', 'GRASSOIL', 'SANDOIL', 'WATEROIL']
 
-        # The two tile layers for the map instance
-        self.layer_0 = []
-        self.layer_1 = []
+        # Lookup tables over the tile IDs for each class of tile
+        self.is_impassable = tile_table(self.impassable)
+        self.is_coal = tile_table(self.coal)
+        self.is_oil = tile_table(self.oil)
+
+        # The tiles that roads and rivers will join up with when drawn
+        self.road_links = tile_table(['ROAD', 'FERRY'])
+        self.river_links = tile_table(['RIVER', 'SHORE', 'OCEAN'])
+        self.autotiles = autotile_table()
+
+        # The two tile layers for the map instance, as grids of tile IDs indexed [y, x]
+        self.layers = {
+            'layer_0': np.zeros((0, 0), dtype=np.uint8),
+            'layer_1': np.zeros((0, 0), dtype=np.uint8)
+        }
+
+        # The connectivity mask of each road and river tile, made of the LINK_* bits for each side it joins up on
+        self.links = np.zeros((0, 0), dtype=np.uint8)
+
+        # The indexes placement is checked against, indexed [y, x]: the number of roads within ROAD_REACH of each tile,
+        # and the number of sides of each tile which join up with a road or ferry terminal, or are shore. They are
+        # None while the map is being generated, or is opened from a map file and is never read as a whole.
+        self.roads_near = None
+        self.road_sides = None
+        self.shore_sides = None
+
+        # Whether the selected item can be placed on the hovered tile, as ((location, item, destroy), cursor colour)
+        self.placement = None
+
+        # Views of the layers by tile name, for code which indexes them as layer_0[y][x]
+        self.layer_0 = LayerView(self, 'layer_0')
+        self.layer_1 = LayerView(self, 'layer_1')
 
         # A list of all the landmasses, and the playable landmasses
         self.islands = []
         self.playable_islands = []
 
+        # The island each tile belongs to, where label i + 1 is self.islands[i] and 0 is water
+        self.island_labels = None
+
+        # The number of coal and oil tiles on each island, indexed [island label, ore], counted when the map is made
+        self.ore_counts = None
+
         # The UI element to be placed
         self.selected_item = None
 
-        # Generate the map based on the input data
-        mapgen = generators.GameMapGenerator(self, data)
+        # The seed the map was generated from, and how each attempt at generating it went
+        self.seed = None
+        self.generation_log = []
+
+        # The generator while it is still decorating a streamed map, and the cache and settings to store it under
+        self.generator = None
+        self.cache = mapcache.MapCache()
+        self.data = data
+
+        # Open the map file if one is given, which carries its own road and river links. Otherwise use the map if it
+        # has already been generated in the background, or load it from the cache if it has been generated before,
+        # or generate it based on the input data. A streamed map is ready to play once the start location has been
+        # picked, and is decorated a stage at a time by generate_step.
+        if data.get('file') is not None:
+            mapfile.open_map(self, data['file'])
+        else:
+            if payload is not None:
+                mapcache.load_payload(self, payload)
+            elif not self.cache.load(self, data):
+                self.generator = generators.GameMapGenerator(self, data, stream)
+                if not stream:
+                    self.generator = None
+                    self.cache.store(self, data)
+            self.rebuild_links()
+            if self.generator is None:
+                self.rebuild_indexes()
+
+    def generate_step(self):
+        """Runs the next decoration stage of a streamed map, storing the map in the cache once it is finished. The
+        tiles each stage changes are redrawn on the next frame. Returns whether the map is finished."""
+        if self.generator is None:
+            return True
+        self.placement = None
+        if not self.generator.step():
+            return False
+        self.generator = None
+        self.rebuild_indexes()
+        self.cache.store(self, self.data)
+        return True
 
     def set_size(self, size):
         self.size = size
@@ -187,6 +204,88 @@ class Map:
         elif dir == 'right':
             self.pos_at = (x + 1, y) if x < self.size[0] - config.SCREEN_X - 1 else (x, y)
 
+    def clear(self):
+        """Fills both layers with empty grass at the current map size."""
+        shape = (self.size[1], self.size[0])
+        self.layers = {
+            'layer_0': np.full(shape, TILE_IDS['GRASS'], dtype=np.uint8),
+            'layer_1': np.full(shape, TILE_IDS['UI_EMPTY'], dtype=np.uint8)
+        }
+        self.links = np.zeros(shape, dtype=np.uint8)
+        self.roads_near = self.road_sides = self.shore_sides = None
+        self.redraw = True
+
+    def rebuild_links(self):
+        """Works out the connectivity mask of every road and river tile on the map. Sides at the edge of the map count
+        as joined up."""
+        layer_0, layer_1 = self.layers['layer_0'], self.layers['layer_1']
+        self.links = np.zeros(layer_1.shape, dtype=np.uint8)
+
+        for tile, table in [('ROAD', self.road_links), ('RIVER', self.river_links)]:
+            joins = np.pad(table[layer_0] | table[layer_1], 1, 'constant', constant_values=True).astype(np.uint8)
+            mask = joins[:-2, 1:-1] * LINK_TOP | joins[2:, 1:-1] * LINK_BOTTOM | \
+                joins[1:-1, :-2] * LINK_LEFT | joins[1:-1, 2:] * LINK_RIGHT
+            placed = layer_1 == TILE_IDS[tile]
+            self.links[placed] = mask[placed]
+
+    def rebuild_indexes(self):
+        """Builds the indexes placement is checked against from the layers, so that every check is a single lookup.
+        set_id keeps them up to date as tiles change from then on."""
+        layer_0, layer_1 = self.layers['layer_0'], self.layers['layer_1']
+        self.roads_near = window_counts(layer_1 == TILE_IDS['ROAD'], ROAD_REACH)
+        self.road_sides = side_counts(self.road_links[layer_1])
+        self.shore_sides = side_counts(layer_0 == TILE_IDS['SHORE'])
+        self.placement = None
+
+    def update_indexes(self, loc, layer, old, new):
+        """Updates the indexes after the tile at location loc on the layer specified changes from one tile ID to
+        another."""
+        x, y = loc
+        if layer == 'layer_1':
+            roads = int(new == TILE_IDS['ROAD']) - int(old == TILE_IDS['ROAD'])
+            if roads:
+                self.roads_near[max(0, y - ROAD_REACH):y + ROAD_REACH + 1,
+                                max(0, x - ROAD_REACH):x + ROAD_REACH + 1] += roads
+            sides, change = self.road_sides, int(self.road_links[new]) - int(self.road_links[old])
+        else:
+            sides, change = self.shore_sides, int(new == TILE_IDS['SHORE']) - int(old == TILE_IDS['SHORE'])
+
+        if change:
+            for nx, ny in self.sides(loc):
+                sides[ny, nx] += change
+
+    def sides(self, loc):
+        """Returns the locations above, below, left and right of location loc which are on the map."""
+        x, y = loc
+        return [(nx, ny) for nx, ny in [(x, y - 1), (x, y + 1), (x - 1, y), (x + 1, y)]
+                if 0 <= nx < self.size[0] and 0 <= ny < self.size[1]]
+
+    def update_links(self, loc):
+        """Works out the connectivity masks of a tile and its neighbours again after the tile has changed."""
+        x, y = loc
+        for nx, ny in [(x, y), (x, y - 1), (x, y + 1), (x - 1, y), (x + 1, y)]:
+            if 0 <= nx < self.size[0] and 0 <= ny < self.size[1]:
+                self.links[ny, nx] = self.link_mask((nx, ny))
+
+    def link_mask(self, loc):
+        """Returns the connectivity mask of a single tile, which is 0 unless it is a road or river."""
+        x, y = loc
+        layer_0, layer_1 = self.layers['layer_0'], self.layers['layer_1']
+        if layer_1[y, x] == TILE_IDS['ROAD']:
+            table = self.road_links
+        elif layer_1[y, x] == TILE_IDS['RIVER']:
+            table = self.river_links
+        else:
+            return 0
+
+        mask = 0
+        for bit, nx, ny in [(LINK_TOP, x, y - 1), (LINK_BOTTOM, x, y + 1), (LINK_LEFT, x - 1, y),
+                            (LINK_RIGHT, x + 1, y)]:
+            if nx < 0 or ny < 0 or nx > self.size[0] - 1 or ny > self.size[1] - 1 \
+                    or table[layer_0[ny, nx]] or table[layer_1[ny, nx]]:
+                mask |= bit
+        return mask
+
     def get(self, loc):
         """Returns the tiles available at the given location loc"""
         x, y = loc
@@ -194,22 +293,38 @@ class Map:
             return None
         else:
             return {
-                'layer_0': self.layer_0[y][x],
-                'layer_1': self.layer_1[y][x]
+                'layer_0': TILE_NAMES[self.layers['layer_0'][y, x]],
+                'layer_1': TILE_NAMES[self.layers['layer_1'][y, x]]
             }
 
+    def get_id(self, loc, layer):
+        """Returns the ID of the tile at location loc on the layer specified"""
+        x, y = loc
+        if x < 0 or y < 0 or x > self.size[0] - 1 or y > self.size[1] - 1:
+            return None
+        return self.layers[layer][y, x]
+
     def set(self, loc, layer, tile):
         """Sets the tile to the given value at location loc, on the layer specified"""
+        self.set_id(loc, layer, TILE_IDS[tile])
+
+    def set_id(self, loc, layer, tile_id):
+        """Sets the tile to the given tile ID at location loc, on the layer specified"""
 
         # Get the location and ensure it's within boundaries
         x, y = loc
-        if x < 0 or y < 0 or x > self.size[0] - 1 or y > self.size[1] - 1 or layer not in ['layer_0', 'layer_1']:
+        if x < 0 or y < 0 or x > self.size[0] - 1 or y > self.size[1] - 1 or layer not in self.layers:
             return
         else:
-            if layer == 'layer_0':
-                self.layer_0[loc[1]][loc[0]] = tile
-            elif layer == 'layer_1':
-                self.layer_1[loc[1]][loc[0]] = tile
+            old = self.layers[layer][y, x]
+            self.layers[layer][y, x] = tile_id
+            if self.roads_near is not None:
+                self.update_indexes(loc, layer, old, tile_id)
+            self.placement = None
+
+            # Redraw the tile, and its neighbours as roads and rivers join up with it
+            self.update_links(loc)
+            self.dirty_tiles.update([(x, y), (x, y - 1), (x, y + 1), (x - 1, y), (x + 1, y)])
 
     def add_to_tile(self, loc):
         if self.can_add_to_tile(self.selected_item.ID, loc):
@@ -220,49 +335,73 @@ class Map:
     def can_add_to_tile(self, tile, loc):
         x, y = loc
         if self.destroy:
-            if self.get(loc)['layer_1'] in ['UI_EMPTY', 'RIVER']:
+            if self.get_id(loc, 'layer_1') in [TILE_IDS['UI_EMPTY'], TILE_IDS['RIVER']]:
                 return False
             return True
         else:
-            if self.get(loc)['layer_0'] in self.impassable:
+            if self.is_impassable[self.get_id(loc, 'layer_0')]:
                 return False
-            if self.get(loc)['layer_1'] != 'UI_EMPTY':
+            if self.get_id(loc, 'layer_1') != TILE_IDS['UI_EMPTY']:
                 return False
             if tile == 'ROAD':
                 # Roads can only be placed if there is an adjacent road or ferry terminal
-                up, down, left, right = False, False, False, False
-                if y > 0 and self.get((loc[0], loc[1] - 1))['layer_1'] in ['ROAD','FERRY']:
-                    left = True
-                if y < self.size[0] - 1 and self.get((loc[0], loc[1] + 1))['layer_1'] in ['ROAD','FERRY']:
-                    right = True
-                if x > 0 and self.get((loc[0] - 1, loc[1]))['layer_1'] in ['ROAD','FERRY']:
-                    left = True
-                if x < self.size[0] - 1 and self.get((loc[0] + 1, loc[1]))['layer_1'] in ['ROAD','FERRY']:
-                    right = True
-                return up or down or left or right
-            elif tile in ['HOUSE', 'BIGHOUSE', 'APARTMENTS', 'STORE', 'POLICE', 'FIRE', 'MINE']:
+                return self.joins_road(loc)
+            elif tile in ['HOUSE', 'BIGHOUSE', 'APARTMENTS', 'STORE', 'POLICE', 'FIRE', 'MINE', 'OILRIG']:
                 # Check if the building is near a road (2 tiles).
-                # Buildings must be placed near to roads. Oil rigs are exempt.
-                near_road = False
-                for x in range(loc[0] - 2, loc[0] + 3):
-                    for y in range(loc[1] - 2, loc[1] + 3):
-                        if self.get((x, y))['layer_1'] == 'ROAD':
-                            near_road = True
-                return near_road
-            elif tile == 'OILRIG':
-                near_road = False
-                for x in range(loc[0] - 2, loc[0] + 3):
-                    for y in range(loc[1] - 2, loc[1] + 3):
-                        if self.get((x, y))['layer_1'] == 'ROAD':
-                            near_road = True
-                return near_road
+                # Buildings must be placed near to roads.
+                return self.near_road(loc)
             return True
 
+    def near_road(self, loc):
+        """Checks whether there is a road within two tiles of location loc."""
+        x, y = loc
+        if self.roads_near is not None:
+            return bool(self.roads_near[y, x])
+        nearby = self.layers['layer_1'][max(0, y - ROAD_REACH):y + ROAD_REACH + 1,
+                                        max(0, x - ROAD_REACH):x + ROAD_REACH + 1]
+        return bool((nearby == TILE_IDS['ROAD']).any())
+
+    def joins_road(self, loc):
+        """Checks whether there is a road or ferry terminal next to location loc."""
+        x, y = loc
+        if self.road_sides is not None:
+            return bool(self.road_sides[y, x])
+        return any(self.road_links[self.get_id(side, 'layer_1')] for side in self.sides(loc))
+
+    def near_shore(self, loc):
+        """Checks whether there is shore next to location loc."""
+        x, y = loc
+        if self.shore_sides is not None:
+            return bool(self.shore_sides[y, x])
+        return any(self.get_id(side, 'layer_0') == TILE_IDS['SHORE'] for side in self.sides(loc))
+
+    def cursor_colour(self, loc):
+        """Returns the colour to shade the cursor with over location loc, for whether the selected item can be placed
+        there, or None for no shading."""
+        tile = self.get(loc)
+
+        # If no selected item, no cursor
+        if self.selected_item == None:
+            return None
+        elif (self.destroy):
+            # List of tiles that we cannot destroy
+            if tile['layer_1'] not in ['UI_EMPTY', 'RIVER', 'MAYORS']:
+                return config.COLOR_R
+            return None
+        else:
+            can_place = True
+            if self.selected_item.building != None:
+                can_place = self.selected_item.building.can_place({'map_xy': loc, 'tile': tile}, self)
+            can_place = can_place and self.can_add_to_tile(self.selected_item.ID, loc)
+            return config.COLOR_G if can_place else config.COLOR_GRAY
+
     def draw(self, screen, offset):
-        """Draws the visible map on the input screen with a given offset."""
+        """Draws the visible map on the input screen with a given offset. The map is kept pre-drawn on a canvas, and
+        only the tiles which have changed or scrolled into view are redrawn. Returns the list of screen rects which
+        have changed, to be passed to pygame.display.update."""
 
-        self.visible_tiles = []
         self.tile_at = None
+        dirty = []
 
         # if draw coordinates are outside the maximum position, set them back
         # failsafe if the prevention of moving the map does not work
@@ -272,111 +411,186 @@ class Map:
         if self.pos_at[1] > self.max_pos[1]:
             self.pos_at = (self.pos_at[0], self.max_pos[1])
 
-        posX, posY = self.pos_at
-        active_tile = {}
-        for y in range(posY, config.SCREEN_Y + posY):
-            if self.size[1] < posY:
-                pass
-            for x in range(posX, config.SCREEN_X + posX):
-                try:
-                    if self.size[0] < posX:
-                        pass
-
-                    # calculate offset here
-
-                    coords = ((x - posX) * config.TILE_W) + config.SIDEBAR_WIDTH, (
-                        y - posY) * config.TILE_H + config.STATUSBAR_HEIGHT
-
-                    tile0 = self.layer_0[y][x]
-                    tile1 = self.layer_1[y][x]
-
-                    active_tile = {
-                        'coords': coords,
-                        'tile': tile1 if tile1 != 'UI_EMPTY' else tile0,
-                        'rect': pygame.Rect(coords[0], coords[1], config.TILE_W, config.TILE_H),
-                        'map_xy': (x, y)
-                    }
-                    self.visible_tiles.append(active_tile)
-
-                    screen.blit(self.tileset.get(tile0), coords)
-
-                    if tile1 == 'UI_EMPTY':
-                        pass
-                    elif tile1 == 'RIVER' or tile1 == 'ROAD':
-                        # wrapping code to connect rivers and roads
-                        tile_dir = ""
-                        accepted_connections = [tile1]
-                        if tile1 == "ROAD":
-                            # Allow roads to connect to the ferry terminals
-                            accepted_connections.append("FERRY")
-                        if tile1 == "RIVER":
-                            # Allow rivers to connect to the shore or oceans
-                            accepted_connections.append("SHORE")
-                            accepted_connections.append("OCEAN")
-                        if y == 0 or self.layer_0[y - 1][x] in accepted_connections or self.layer_1[y - 1][
-                            x] in accepted_connections:
-                            tile_dir += "t"
-                        if y == self.size[1] or self.layer_0[y + 1][x] in accepted_connections or self.layer_1[y + 1][
-                            x] in accepted_connections:
-                            tile_dir += "b"
-                        if x == 0 or self.layer_0[y][x - 1] in accepted_connections or self.layer_1[y][
-                                    x - 1] in accepted_connections:
-                            tile_dir += "l"
-                        if x == self.size[0] or self.layer_0[y][x + 1] in accepted_connections or self.layer_1[y][
-                                    x + 1] in accepted_connections:
-                            tile_dir += "r"
-
-                        value_table = {
-                            't': 11,
-                            'b': 12,
-                            'l': 13,
-                            'r': 14,
-                            'lr': 0,
-                            'tb': 1,
-                            'tl': 2,
-                            'tr': 3,
-                            'bl': 4,
-                            'br': 5,
-                            'tbr': 6,
-                            'tbl': 7,
-                            'tlr': 8,
-                            'blr': 9,
-                            'tblr': 10
-                        }
-
-                        tile1 = "{}_{}".format(tile1, value_table[tile_dir]) if tile_dir in value_table else tile1
-
-                        screen.blit(self.tileset.get(tile1), coords)
-
-                    else:
-                        screen.blit(self.tileset.get(tile1), coords)
-                except Exception, e:
-                    raise Exception(
-                        "Tilemap drawing failed at coordinates [{}, {}]. Exception rasied: {}".format(x, y, e))
-
-                # Draw the cursor over the currently hovered tile
-                if active_tile['rect'].collidepoint(pygame.mouse.get_pos()):
-                    possible_cursor = pygame.Surface((20, 20))
-                    possible_cursor.set_alpha(120)
-                    self.tile_at = {
-                        'map_xy': (x, y),
-                        'tile': self.get((x, y))
-                    }
-
-                    # If no selected item, no cursor
-                    if self.selected_item == None:
-                        possible_cursor.set_alpha(0)
-                    elif (self.destroy):
-                        # List of tiles that we cannot destroy
-                        if self.tile_at['tile']['layer_1'] not in ['UI_EMPTY', 'RIVER', 'MAYORS']:
-                            possible_cursor.fill(config.COLOR_R)
-                        else:
-                            possible_cursor.set_alpha(0)
-                    else:
-                        can_place = True
-                        if self.selected_item.building != None:
-                            can_place = self.selected_item.building.can_place(self.tile_at, self)
-                        can_place = can_place and self.can_add_to_tile(self.selected_item.ID, (x, y))
-                        possible_cursor.fill(config.COLOR_G if can_place else config.COLOR_GRAY)
-                    screen.blit(possible_cursor, (active_tile['coords'][0] + 2, active_tile['coords'][1] + 2))
-                    screen.blit(self.tileset.get('CURSOR'), active_tile['coords'])
+        posX, posY = tuple(self.pos_at)
+        origin = (config.SIDEBAR_WIDTH + offset[0], config.STATUSBAR_HEIGHT + offset[1])
+        view = pygame.Rect(origin, (config.SCREEN_X * config.TILE_W, config.SCREEN_Y * config.TILE_H))
+
+        if self.canvas is None:
+            self.canvas = pygame.Surface(view.size)
+            self.redraw = True
+
+        # Whether the whole view has changed this frame
+        full = False
+
+        if not self.redraw and self.canvas_pos != (posX, posY):
+            # Shift the existing pixels when the map is panned and only draw the tiles which have come into view
+            shift_x, shift_y = posX - self.canvas_pos[0], posY - self.canvas_pos[1]
+            if abs(shift_x) < config.SCREEN_X and abs(shift_y) < config.SCREEN_Y:
+                self.canvas.scroll(-shift_x * config.TILE_W, -shift_y * config.TILE_H)
+                self.canvas_pos = (posX, posY)
+
+                new_x = range(config.SCREEN_X - shift_x, config.SCREEN_X) if shift_x > 0 else range(0, -shift_x)
+                new_y = range(config.SCREEN_Y - shift_y, config.SCREEN_Y) if shift_y > 0 else range(0, -shift_y)
+                for x in new_x:
+                    self.dirty_tiles.update((posX + x, posY + y) for y in range(config.SCREEN_Y))
+                for y in new_y:
+                    self.dirty_tiles.update((posX + x, posY + y) for x in range(config.SCREEN_X))
+                full = True
+            else:
+                self.redraw = True
+
+        if self.redraw:
+            self.canvas_pos = (posX, posY)
+            self.dirty_tiles = set((x, y) for y in range(posY, posY + config.SCREEN_Y)
+                                   for x in range(posX, posX + config.SCREEN_X))
+            self.redraw = False
+            full = True
+
+        for x, y in self.dirty_tiles:
+            if posX <= x < posX + config.SCREEN_X and posY <= y < posY + config.SCREEN_Y:
+                rect = self.draw_tile((x, y))
+                if not full:
+                    dirty.append(rect.move(origin))
+        self.dirty_tiles = set()
+
+        if full:
+            screen.blit(self.canvas, origin)
+            dirty.append(view)
+        else:
+            for rect in dirty:
+                screen.blit(self.canvas, rect, rect.move(-origin[0], -origin[1]))
+
+        # Put back the map under the cursor drawn last frame
+        if self.cursor_rect is not None:
+            screen.blit(self.canvas, self.cursor_rect, self.cursor_rect.move(-origin[0], -origin[1]))
+            dirty.append(self.cursor_rect)
+            self.cursor_rect = None
+
+        # Draw the cursor over the currently hovered tile
+        loc = self.tile_at_pos(pygame.mouse.get_pos(), offset)
+        if loc is not None:
+            x, y = loc
+            coords = (origin[0] + (x - posX) * config.TILE_W, origin[1] + (y - posY) * config.TILE_H)
+            possible_cursor = pygame.Surface((20, 20))
+            possible_cursor.set_alpha(120)
+            self.tile_at = {
+                'map_xy': (x, y),
+                'tile': self.get((x, y))
+            }
+
+            # Whether the item can be placed only changes with the tile, the item or the map, so it is only worked
+            # out again when one of them changes
+            key = ((x, y), self.selected_item, self.destroy)
+            if self.placement is None or self.placement[0] != key:
+                self.placement = (key, self.cursor_colour((x, y)))
+            colour = self.placement[1]
+
+            if colour is None:
+                possible_cursor.set_alpha(0)
+            else:
+                possible_cursor.fill(colour)
+            screen.blit(possible_cursor, (coords[0] + 2, coords[1] + 2))
+            screen.blit(self.tileset.get('CURSOR'), coords)
+
+            self.cursor_rect = pygame.Rect(coords, (config.TILE_W, config.TILE_H))
+            dirty.append(self.cursor_rect)
+
+        return dirty
+
+    def restore(self, screen, rect, offset=(0, 0)):
+        """Redraws the part of the map covered by a screen rect, e.g. to remove UI drawn over the map last frame."""
+        if self.canvas is None:
+            return
+        origin = (config.SIDEBAR_WIDTH + offset[0], config.STATUSBAR_HEIGHT + offset[1])
+        area = pygame.Rect(rect).move(-origin[0], -origin[1]).clip(self.canvas.get_rect())
+        if area.width > 0 and area.height > 0:
+            screen.blit(self.canvas, area.move(origin), area)
+
+    def tile_at_pos(self, pos, offset=(0, 0)):
+        """Returns the map location of the tile drawn at a screen position, or None if it is outside the map."""
+        x = (pos[0] - config.SIDEBAR_WIDTH - offset[0]) // config.TILE_W
+        y = (pos[1] - config.STATUSBAR_HEIGHT - offset[1]) // config.TILE_H
+        if x < 0 or y < 0 or x >= config.SCREEN_X or y >= config.SCREEN_Y:
+            return None
+        loc = (x + self.pos_at[0], y + self.pos_at[1])
+        if loc[0] > self.size[0] - 1 or loc[1] > self.size[1] - 1:
+            return None
+        return loc
+
+    def draw_tile(self, loc):
+        """Draws a single map tile onto the canvas, returning the rect it was drawn in."""
+        x, y = loc
+        coords = ((x - self.canvas_pos[0]) * config.TILE_W, (y - self.canvas_pos[1]) * config.TILE_H)
+        rect = pygame.Rect(coords, (config.TILE_W, config.TILE_H))
+
+        if x > self.size[0] - 1 or y > self.size[1] - 1:
+            self.canvas.fill((0, 0, 0), rect)
+            return rect
+
+        try:
+            tile0 = self.layers['layer_0'][y, x]
+            # Roads and rivers are drawn joined up to their neighbours using the tile's connectivity mask
+            tile1 = self.autotiles[self.layers['layer_1'][y, x], self.links[y, x]]
+
+            self.canvas.blit(self.tileset.get_id(tile0), coords)
+
+            if tile1 != TILE_IDS['UI_EMPTY']:
+                self.canvas.blit(self.tileset.get_id(tile1), coords)
+        except Exception, e:
+            raise Exception(
+                "Tilemap drawing failed at coordinates [{}, {}]. Exception rasied: {}".format(x, y, e))
+
+        return rect
+
+
+def window_counts(mask, radius):
+    """Counts the True tiles of a mask within radius tiles of each tile, across and down, as an int16 array."""
+    size = 2 * radius + 1
+    padded = np.pad(mask.astype(np.int16), radius, 'constant')
+    rows = sum(padded[i:i + mask.shape[0]] for i in range(size))
+    return sum(rows[:, i:i + mask.shape[1]] for i in range(size))
+
+
+def side_counts(mask):
+    """Counts the True tiles above, below, left and right of each tile of a mask, as an int16 array."""
+    padded = np.pad(mask.astype(np.int16), 1, 'constant')
+    return padded[:-2, 1:-1] + padded[2:, 1:-1] + padded[1:-1, :-2] + padded[1:-1, 2:]
+
+
+class LayerView:
+    """A view of one of the map's tile ID layers which reads and writes tile names, for code which still indexes the
+    layers as map.layer_0[y][x]."""
+    def __init__(self, map, layer):
+        self.map = map
+        self.layer = layer
+
+    def __getitem__(self, y):
+        return LayerRow(self.map, self.layer, y)
+
+    def __len__(self):
+        return self.map.layers[self.layer].shape[0]
+
+    def __iter__(self):
+        for y in range(len(self)):
+            yield self[y]
+
+
+class LayerRow:
+    """A single row of a LayerView."""
+    def __init__(self, map, layer, y):
+        self.map = map
+        self.layer = layer
+        self.y = y
+
+    def __getitem__(self, x):
+        return TILE_NAMES[self.map.layers[self.layer][self.y, x]]
+
+    def __setitem__(self, x, tile):
+        self.map.set((x, self.y), self.layer, tile)
+
+    def __len__(self):
+        return self.map.layers[self.layer].shape[1]
+
+    def __iter__(self):
+        for x in range(len(self)):
+            yield self[x]
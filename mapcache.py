@@ -0,0 +1,134 @@
+#!/usr/bin/python
+
+import os
+import errno
+import hashlib
+import tempfile
+
+import numpy as np
+
+import config
+from generators import GENERATOR_VERSION, count_ores
+from regions import region_tiles
+
+
+def cache_key(data, seed):
+    """Returns the key a generated map is stored under. Maps are only ever the same when all of the generation
+    settings, the seed and the version of the generators match."""
+    settings = (data['map'], data['rainfall'], data['resources'], data['size'], data.get('start', 'random'),
+                data.get('noise', 'simplex'), seed, GENERATOR_VERSION)
+    return hashlib.sha1(repr(settings)).hexdigest()
+
+
+def map_payload(map):
+    """Packs a generated map into a dictionary of numpy arrays, holding everything needed to rebuild it without
+    generating it again. The payload is compact and can be pickled or saved with numpy."""
+    playable = [i for i, island in enumerate(map.islands) if any(island is p for p in map.playable_islands)]
+    return {
+        'seed': np.array(map.seed, dtype=np.int64),
+        'layer_0': map.layers['layer_0'],
+        'layer_1': map.layers['layer_1'],
+        'island_labels': map.island_labels.astype(np.uint16),
+        'playable': np.array(playable, dtype=np.int32),
+        'start_loc': np.array(getattr(map, 'start_loc', (-1, -1)), dtype=np.int32),
+        'pos_at': np.array(map.pos_at, dtype=np.int32)
+    }
+
+
+def load_payload(map, payload):
+    """Fills a map from a payload made by map_payload. The island tile lists are rebuilt from the island labels."""
+    layer_0 = payload['layer_0']
+    map.set_size((layer_0.shape[1], layer_0.shape[0]))
+    map.layers = {'layer_0': layer_0, 'layer_1': payload['layer_1']}
+    map.seed = int(payload['seed'])
+
+    labels = payload['island_labels'].astype(np.int32)
+    map.island_labels = labels
+    map.islands = region_tiles(labels, int(labels.max()))
+    map.playable_islands = [map.islands[i] for i in payload['playable'].tolist()]
+    map.ore_counts = count_ores(map)
+
+    map.start_loc = tuple(payload['start_loc'].tolist())
+    map.pos_at = tuple(payload['pos_at'].tolist())
+    map.redraw = True
+
+
+class MapCache:
+    """An on-disk cache of finished maps, stored as compressed numpy archives named by their cache key. Once the
+    cache grows beyond its maximum size the least recently used maps are removed."""
+    def __init__(self, path=None, max_size=None):
+        self.path = config.CACHE_DIR if path is None else path
+        self.max_size = config.CACHE_SIZE if max_size is None else max_size
+
+    def file_for(self, key):
+        return os.path.join(self.path, key + ".npz")
+
+    def load(self, map, data):
+        """Fills the map from the cache if a map with the same settings and seed has been generated before. Returns
+        whether the map was found."""
+        if data.get('seed') is None:
+            return False
+
+        path = self.file_for(cache_key(data, data['seed']))
+        if not os.path.exists(path):
+            return False
+
+        try:
+            archive = np.load(path)
+            payload = dict(archive.items())
+            archive.close()
+            load_payload(map, payload)
+        except Exception, e:
+            print "Failed to load cached map: {}".format(e)
+            os.remove(path)
+            return False
+
+        # mark the map as recently used
+        os.utime(path, None)
+        return True
+
+    def store(self, map, data):
+        """Saves a freshly generated map into the cache, then trims the cache back down to its maximum size. Maps are
+        stored by several worker processes at once, so each writes its own temporary file and none of them fail
+        because another got to the cache first."""
+        try:
+            os.makedirs(self.path)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        path = self.file_for(cache_key(data, map.seed))
+
+        # write to a temporary file first so an interrupted save never leaves a broken map behind
+        fd, temp = tempfile.mkstemp(".tmp", dir=self.path)
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, **map_payload(map))
+        os.rename(temp, path)
+
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used maps until the cache fits within its maximum size."""
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(".npz"):
+                continue
+            # another process may have evicted the map since it was listed
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for mtime, size, name in entries)
+        for mtime, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+            total -= size
@@ -0,0 +1,179 @@
+#!/usr/bin/python
+
+import struct
+
+import numpy as np
+
+# Map files start with a header, followed by a table describing each plane and then the planes themselves. Each plane
+# is cut into square chunks which are stored one after another, so that the tiles near each other on the map are near
+# each other in the file and reading the area around the viewport only touches a few pages of it.
+MAGIC = "GMAP"
+FORMAT_VERSION = 1
+
+# magic, version, width, height, chunk size, seed, start location, view position, number of planes
+HEADER = struct.Struct("<4sHIIIqiiiiH")
+# name, numpy type, offset of the plane in the file
+PLANE_ENTRY = struct.Struct("<16s4sQ")
+
+# The planes start on page boundaries, and a chunk of a uint8 plane fills exactly one page
+ALIGNMENT = 4096
+CHUNK_SIZE = 64
+
+# The planes every map file has, and the optional planes, with their types
+PLANES = [('layer_0', np.uint8), ('layer_1', np.uint8), ('links', np.uint8)]
+OPTIONAL_PLANES = [('heights', np.float32), ('island_labels', np.uint16)]
+
+
+class ChunkedPlane:
+    """A 2D plane of a map file indexed [y, x] like a numpy array, backed by a memory map of its chunks. Single tiles
+    and rectangles of tiles can be read and written, and only the chunks they fall in are touched. Rectangles are
+    always returned as new 2D arrays, and np.asarray reads the whole plane."""
+    def __init__(self, data, shape):
+        # The memory map, shaped [chunk y, chunk x, y, x]
+        self.data = data
+        self.shape = shape
+        self.dtype = data.dtype
+        self.chunk_size = data.shape[2]
+
+    def __getitem__(self, index):
+        y, x = index
+        if isinstance(y, slice) or isinstance(x, slice):
+            (y0, y1), (x0, x1) = self.bounds(y, x)
+            result = np.empty((y1 - y0, x1 - x0), dtype=self.dtype)
+            for (cy, cx, chunk_y, chunk_x), area in self.chunks(y0, y1, x0, x1):
+                result[area] = self.data[cy, cx, chunk_y, chunk_x]
+            return result
+
+        size = self.chunk_size
+        return self.data[y // size, x // size, y % size, x % size]
+
+    def __setitem__(self, index, value):
+        y, x = index
+        if isinstance(y, slice) or isinstance(x, slice):
+            (y0, y1), (x0, x1) = self.bounds(y, x)
+            value = np.broadcast_to(value, (y1 - y0, x1 - x0))
+            for (cy, cx, chunk_y, chunk_x), area in self.chunks(y0, y1, x0, x1):
+                self.data[cy, cx, chunk_y, chunk_x] = value[area]
+            return
+
+        size = self.chunk_size
+        self.data[y // size, x // size, y % size, x % size] = value
+
+    def __array__(self, dtype=None):
+        plane = self[:, :]
+        return plane if dtype is None else plane.astype(dtype)
+
+    def bounds(self, y, x):
+        """Returns the (start, stop) rows and columns covered by a pair of slices or indexes, clipped to the plane."""
+        y = y if isinstance(y, slice) else slice(y, y + 1)
+        x = x if isinstance(x, slice) else slice(x, x + 1)
+        return y.indices(self.shape[0])[:2], x.indices(self.shape[1])[:2]
+
+    def chunks(self, y0, y1, x0, x1):
+        """Yields each chunk overlapping a rectangle of the plane, as the index of the part of the chunk which overlaps
+        it and the slices of the rectangle that part covers."""
+        size = self.chunk_size
+        for cy in range(y0 // size, (y1 + size - 1) // size):
+            top, bottom = max(y0, cy * size), min(y1, (cy + 1) * size)
+            for cx in range(x0 // size, (x1 + size - 1) // size):
+                left, right = max(x0, cx * size), min(x1, (cx + 1) * size)
+                chunk = (cy, cx, slice(top - cy * size, bottom - cy * size), slice(left - cx * size, right - cx * size))
+                yield chunk, (slice(top - y0, bottom - y0), slice(left - x0, right - x0))
+
+    def flush(self):
+        self.data.flush()
+
+
+class MapFile:
+    """An open map file, with each of its planes memory mapped as a ChunkedPlane. The mode is that of numpy.memmap:
+    'r' to read, 'r+' to read and write, or 'c' to make changes in memory only and leave the file as it was."""
+    def __init__(self, path, mode='r'):
+        with open(path, 'rb') as f:
+            magic, version, width, height, chunk_size, seed, start_x, start_y, pos_x, pos_y, count = \
+                HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError("{} is not a map file".format(path))
+            if version != FORMAT_VERSION:
+                raise ValueError("Map file {} has unsupported version {}".format(path, version))
+            entries = [PLANE_ENTRY.unpack(f.read(PLANE_ENTRY.size)) for i in range(count)]
+
+        self.path = path
+        self.size = (width, height)
+        self.chunk_size = chunk_size
+        self.seed = seed if seed >= 0 else None
+        self.start_loc = (start_x, start_y)
+        self.pos_at = (pos_x, pos_y)
+
+        rows, columns = chunk_grid(self.size, chunk_size)
+        self.planes = {}
+        for name, dtype, offset in entries:
+            data = np.memmap(path, np.dtype(dtype.rstrip("\0")), mode, offset, (rows, columns, chunk_size, chunk_size))
+            self.planes[name.rstrip("\0")] = ChunkedPlane(data, (height, width))
+
+    def flush(self):
+        for plane in self.planes.values():
+            plane.flush()
+
+
+def chunk_grid(size, chunk_size):
+    """Returns the number of rows and columns of chunks a map of the given size is cut into."""
+    return (size[1] + chunk_size - 1) // chunk_size, (size[0] + chunk_size - 1) // chunk_size
+
+
+def create_map_file(path, size, planes, chunk_size=CHUNK_SIZE, seed=None, start_loc=(-1, -1), pos_at=(0, 0)):
+    """Creates an empty map file with the given (name, type) planes, and opens it for writing. The file is sparse
+    where the file system allows, so planes can be filled in a chunk at a time without ever being held in memory."""
+    rows, columns = chunk_grid(size, chunk_size)
+    table_end = HEADER.size + PLANE_ENTRY.size * len(planes)
+
+    entries = []
+    offset = align(table_end)
+    for name, dtype in planes:
+        entries.append(PLANE_ENTRY.pack(name, np.dtype(dtype).str, offset))
+        offset = align(offset + rows * columns * chunk_size * chunk_size * np.dtype(dtype).itemsize)
+
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, size[0], size[1], chunk_size, -1 if seed is None else seed,
+                            start_loc[0], start_loc[1], pos_at[0], pos_at[1], len(planes)))
+        f.write("".join(entries))
+        f.truncate(offset)
+
+    return MapFile(path, 'r+')
+
+
+def align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def save_map(map, path, heights=None, chunk_size=CHUNK_SIZE):
+    """Saves a map into a map file, along with its heightfield if given."""
+    arrays = [('layer_0', map.layers['layer_0']), ('layer_1', map.layers['layer_1']), ('links', map.links)]
+    if heights is not None:
+        arrays.append(('heights', heights))
+    if map.island_labels is not None:
+        arrays.append(('island_labels', map.island_labels))
+
+    types = dict(PLANES + OPTIONAL_PLANES)
+    map_file = create_map_file(path, map.size, [(name, types[name]) for name, array in arrays], chunk_size, map.seed,
+                               getattr(map, 'start_loc', (-1, -1)), map.pos_at)
+    for name, array in arrays:
+        map_file.planes[name][:, :] = np.asarray(array)
+    map_file.flush()
+
+
+def open_map(map, path):
+    """Fills a map from a map file. The planes are memory mapped copy on write, so only the chunks which are drawn or
+    looked at are read from disk, and changes made in the game never reach the file. The island tile lists are left
+    empty, as building them would mean reading the whole map."""
+    map_file = MapFile(path, 'c')
+    map.set_size(map_file.size)
+    map.layers = {'layer_0': map_file.planes['layer_0'], 'layer_1': map_file.planes['layer_1']}
+    map.links = map_file.planes['links']
+    map.island_labels = map_file.planes.get('island_labels')
+    map.islands = []
+    map.playable_islands = []
+
+    map.seed = map_file.seed
+    map.start_loc = map_file.start_loc
+    map.pos_at = map_file.pos_at
+    map.redraw = True
@@ -0,0 +1,106 @@
+#!/usr/bin/python
+
+import multiprocessing
+
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    # concurrent.futures needs the futures backport on Python 2, use a multiprocessing pool without it
+    ProcessPoolExecutor = None
+
+import config
+import map
+import mapcache
+
+
+def generate_payload(data):
+    """Generates a map in a worker process and returns it as a payload. The worker also stores the map in the cache,
+    so a map which is never asked for still saves generating it again later."""
+    generated = map.Map(None, (config.SCREEN_X, config.SCREEN_Y), data)
+    return mapcache.map_payload(generated)
+
+
+class PoolTask:
+    """A map being generated by a multiprocessing pool, with the parts of the concurrent.futures.Future interface
+    the map pool uses."""
+    def __init__(self, result):
+        self.async_result = result
+
+    def done(self):
+        return self.async_result.ready()
+
+    def result(self):
+        return self.async_result.get()
+
+    def cancel(self):
+        # a multiprocessing task can't be withdrawn, the map will still be cached once it finishes
+        return False
+
+
+class MapPool:
+    """Generates maps in background worker processes so they are ready before the player asks for them. Maps are
+    prefetched for the settings the player is likely to pick, and handed to the game screen as payloads."""
+    def __init__(self, workers=None, max_pending=3):
+        if workers is None:
+            workers = max(1, multiprocessing.cpu_count() - 1)
+
+        if ProcessPoolExecutor is not None:
+            self.executor = ProcessPoolExecutor(workers)
+            self.pool = None
+        else:
+            self.executor = None
+            self.pool = multiprocessing.Pool(workers)
+
+        # The most maps waiting on or being generated at once, and those maps by cache key in the order requested
+        self.max_pending = max_pending
+        self.pending = []
+
+    def submit(self, data):
+        if self.executor is not None:
+            return self.executor.submit(generate_payload, data)
+        return PoolTask(self.pool.apply_async(generate_payload, (data,)))
+
+    def prefetch(self, data):
+        """Starts generating a map with the given settings in the background, unless it is already underway. The
+        oldest maps still waiting for a worker are cancelled to make room for it, and if none of them can be the map
+        isn't prefetched, so the workers never fall more than max_pending maps behind."""
+        key = mapcache.cache_key(data, data['seed'])
+        if any(pending_key == key for pending_key, task in self.pending):
+            return
+
+        # finished maps which were never used are already in the cache
+        self.pending = [(pending_key, task) for pending_key, task in self.pending if not task.done()]
+        for pending_key, task in list(self.pending):
+            if len(self.pending) < self.max_pending:
+                break
+            if task.cancel():
+                self.pending.remove((pending_key, task))
+
+        if len(self.pending) >= self.max_pending:
+            return
+        self.pending.append((key, self.submit(data)))
+
+    def take(self, data):
+        """Returns the payload of a map with the given settings if one has been prefetched and is finished. Returns
+        None if the map hasn't been prefetched, is still being generated or failed to generate. Waiting for a map
+        could mean waiting for every map queued ahead of it, so one still underway is left to finish into the cache
+        and the game generates the map itself."""
+        key = mapcache.cache_key(data, data['seed'])
+        for pending_key, task in self.pending:
+            if pending_key == key:
+                if not task.done():
+                    return None
+                self.pending.remove((pending_key, task))
+                try:
+                    return task.result()
+                except Exception, e:
+                    print "Failed to generate map in the background: {}".format(e)
+                    return None
+        return None
+
+    def shutdown(self):
+        """Stops the workers without waiting for any maps still being generated."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+        else:
+            self.pool.terminate()
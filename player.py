@@ -1,4 +1,4 @@
-import random
+import bisect
 
 import pygame
 import config
@@ -35,37 +35,86 @@ class Mayor:
 
         self.roads = 0
 
+        # The building placed at each map location
+        self.placed = {}
+
+        # Running totals over all of the buildings, kept up to date as buildings are added and removed so that the
+        # economy never has to go through every building
+        self.totals = {
+            'population': 0,
+            'jobs': 0,
+            'residential_tax': 0,
+            'civic_costs': 0,
+            'fire_safety': 0,
+            'police_safety': 0
+        }
+
+        # The businesses in the order they were built, which is the order they are staffed in, as (location,
+        # building), with the total jobs and tax of the businesses before each one
+        self.businesses = []
+        self.business_jobs = [0]
+        self.business_tax = [0]
 
-    def add_building(self, building):
+
+    def add_building(self, building, loc=None):
+        """Adds a building the player has placed, at map location loc if given."""
         if building.type != None:
             self.buildings[building.type].append(building)
+            if loc is not None:
+                self.placed[loc] = building
+            self.count(building, 1)
+
+            if building.type in ['c', 'i']:
+                self.businesses.append((loc, building))
+                self.business_jobs.append(self.business_jobs[-1] + building.jobs)
+                self.business_tax.append(self.business_tax[-1] + building.tax)
+
+    def remove_building(self, loc):
+        """Removes the building placed at map location loc, returning it, or None if there is no building there."""
+        building = self.placed.pop(loc, None)
+        if building is None:
+            return None
+
+        self.buildings[building.type].remove(building)
+        self.count(building, -1)
+
+        if building.type in ['c', 'i']:
+            self.businesses.remove((loc, building))
+            self.business_jobs, self.business_tax = [0], [0]
+            for business_loc, business in self.businesses:
+                self.business_jobs.append(self.business_jobs[-1] + business.jobs)
+                self.business_tax.append(self.business_tax[-1] + business.tax)
+        return building
+
+    def count(self, building, sign):
+        """Adds a building into the running totals, or takes it out of them with a sign of -1."""
+        if building.type == 'r':
+            self.totals['population'] += sign * building.population
+            self.totals['residential_tax'] += sign * building.tax
+        else:
+            self.totals['jobs'] += sign * building.jobs
+
+        if building.type == 'priv':
+            self.totals['civic_costs'] += sign * building.tax
+            self.totals['fire_safety'] += sign * getattr(building, 'fire_safety', 0)
+            self.totals['police_safety'] += sign * getattr(building, 'police_safety', 0)
 
     def calc_expenses(self):
         decrease = 0.00
 
         decrease += 0.01 * self.roads
-
-        for priv in self.buildings['priv']:
-            decrease += priv.tax
+        decrease += self.totals['civic_costs']
 
         return decrease
 
     def calc_income(self):
-        increase = 0.00
-        job_counter = 0
-        
-        for res in self.buildings['r']:
-            increase += res.tax
-
-        # only jobs which have people working for them produce tax
-        business = self.buildings['c'] + self.buildings['i']
-        counter = 0
-        while job_counter < self.population and counter < len(business):
-            random.shuffle(business)
-            for bus in business:
-                increase += bus.tax
-                job_counter += bus.jobs
-                counter += 1
+        increase = 0.00 + self.totals['residential_tax']
+
+        # only jobs which have people working for them produce tax. The businesses are staffed in the order they were
+        # built, so those with people working for them are every business before the one where the jobs run past
+        # the population, and that one too.
+        employed = bisect.bisect_left(self.business_jobs, self.population, 0, len(self.businesses))
+        increase += self.business_tax[employed]
         return increase
 
     def positive_times(self):
@@ -82,21 +131,8 @@ class Mayor:
 
     def calc(self, calc_services):
 
-
-        self.population = 0
-        self.jobs = 0
-        
-        for house in self.buildings['r']:
-            self.population += house.population
-
-        for business in self.buildings['c']:
-            self.jobs += business.jobs
-        for business in self.buildings['i']:
-            self.jobs += business.jobs
-
-        for priv in self.buildings['priv']:
-            self.jobs += priv.jobs
-
+        self.population = self.totals['population']
+        self.jobs = self.totals['jobs']
 
         decrease = self.calc_expenses()
         increase = self.calc_income()
@@ -117,10 +153,5 @@ class Mayor:
             self.money += increase
             
         if calc_services:
-            self.fire_safety = 40
-            self.police_safety = 40
-            for priv in self.buildings['priv']:
-                if hasattr(priv, 'fire_safety'):
-                    self.fire_safety += priv.fire_safety
-                if hasattr(priv, 'police_safety'):
-                    self.police_safety += priv.police_safety
+            self.fire_safety = 40 + self.totals['fire_safety']
+            self.police_safety = 40 + self.totals['police_safety']
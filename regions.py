@@ -0,0 +1,79 @@
+#!/usr/bin/python
+
+import numpy as np
+
+
+def label_regions(mask):
+    """Labels the 4-connected regions of True values in a 2D boolean array indexed [y, x]. Works on horizontal runs
+    of tiles rather than single tiles: runs are joined to the overlapping runs in the row above with a union-find,
+    so the pass is linear in the size of the map and never recurses. Returns an integer label grid (0 for
+    background) and the number of regions, with regions numbered in the order a row-major scan first reaches them."""
+    h, w = mask.shape
+
+    # Find the start (inclusive) and end (exclusive) of every run of tiles, in row-major order
+    padded = np.zeros((h, w + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    run_y, run_start = np.nonzero(edges == 1)
+    run_end = np.nonzero(edges == -1)[1]
+
+    runs = len(run_y)
+    if runs == 0:
+        return np.zeros((h, w), dtype=np.int32), 0
+
+    row_first = np.searchsorted(run_y, np.arange(h + 1)).tolist()
+    starts, ends = run_start.tolist(), run_end.tolist()
+    parent = range(runs)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for y in range(1, h):
+        above, above_end = row_first[y - 1], row_first[y]
+        for i in range(row_first[y], row_first[y + 1]):
+            # skip the runs above which finish before this one begins
+            while above < above_end and ends[above] <= starts[i]:
+                above += 1
+            j = above
+            while j < above_end and starts[j] < ends[i]:
+                root_i, root_j = find(i), find(j)
+                # the earliest run always becomes the root, so labels follow scan order
+                if root_i != root_j:
+                    parent[max(root_i, root_j)] = min(root_i, root_j)
+                j += 1
+
+    run_label = np.zeros(runs, dtype=np.int32)
+    count = 0
+    for i in range(runs):
+        root = find(i)
+        if root == i:
+            count += 1
+            run_label[i] = count
+        else:
+            run_label[i] = run_label[root]
+
+    # Every tile takes the label of the run it belongs to
+    run_marker = np.zeros(h * w, dtype=np.int32)
+    run_marker[run_y * w + run_start] = 1
+    run_index = np.cumsum(run_marker) - 1
+    labels = np.where(mask.ravel(), run_label[np.maximum(run_index, 0)], 0)
+
+    return labels.reshape(h, w).astype(np.int32), count
+
+
+def region_tiles(labels, count):
+    """Returns a list of the (x, y) tiles in each labelled region, each sorted by row and then from right to left."""
+    ys, xs = np.nonzero(labels)
+    region = labels[ys, xs]
+    order = np.lexsort((-xs, ys, region))
+    xs, ys = xs[order].tolist(), ys[order].tolist()
+
+    tiles = []
+    end = 0
+    for size in np.bincount(region, minlength=count + 1)[1:].tolist():
+        tiles.append(zip(xs[end:end + size], ys[end:end + size]))
+        end += size
+    return tiles
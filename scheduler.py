@@ -0,0 +1,102 @@
+#!/usr/bin/python
+
+import time
+
+# The most simulation ticks run in a single frame to catch up after a slow one. Past that the simulation falls
+# behind real time instead of stalling the frames after it.
+MAX_STEPS = 5
+
+# How long the jobs may run for in each frame, in seconds. Every job gets at least one step a frame, however long.
+JOB_BUDGET = 0.008
+
+
+class Scheduler:
+    """Runs the simulation at a fixed rate of ticks per second, independent of the frame rate. Each frame runs however
+    many ticks have come due since the last one, up to max_steps, so that a slow frame doesn't slow the simulation
+    down and a fast one doesn't speed it up. The tasks run every so many ticks, so the simulation only depends on the
+    number of ticks run and not on how they fall between frames.
+
+    Long jobs, such as generating the rest of the map, are run a step at a time between frames for as long as the
+    job budget allows. The time taken by each task, job and phase of a frame is added up in self.timers."""
+    def __init__(self, tick_rate, max_steps=MAX_STEPS, job_budget=JOB_BUDGET, clock=time.time):
+        self.interval = 1.0 / tick_rate
+        self.max_steps = max_steps
+        self.job_budget = job_budget
+        self.clock = clock
+
+        # The number of ticks run so far, the time which has passed since the last tick was due, and the time dropped
+        # because it couldn't be caught up on
+        self.ticks = 0
+        self.lag = 0.0
+        self.dropped = 0.0
+        self.last_frame = None
+
+        # The tasks as (period in ticks, name, function, arguments), and the jobs as (name, step function)
+        self.tasks = []
+        self.jobs = []
+
+        # The calls to and total time spent in each task, job and phase, by name
+        self.timers = {}
+
+    def every(self, period, name, function, *args):
+        """Runs function(*args) every period ticks."""
+        self.tasks.append((period, name, function, args))
+
+    def add_job(self, name, step):
+        """Adds a long job, which is run by calling step() between frames until it returns True."""
+        self.jobs.append((name, step))
+
+    def frame(self):
+        """Runs the ticks which have come due since the last frame, then the jobs for as long as the budget allows.
+        Returns the number of ticks run."""
+        now = self.clock()
+        if self.last_frame is not None:
+            self.lag += now - self.last_frame
+        self.last_frame = now
+
+        steps = 0
+        while self.lag >= self.interval and steps < self.max_steps:
+            self.ticks += 1
+            for period, name, function, args in self.tasks:
+                if self.ticks % period == 0:
+                    self.measure(name, function, *args)
+            self.lag -= self.interval
+            steps += 1
+
+        # drop the time which couldn't be caught up on, rather than trying to catch up on it in later frames
+        if self.lag >= self.interval:
+            self.dropped += self.lag - self.lag % self.interval
+            self.lag %= self.interval
+
+        self.run_jobs()
+        return steps
+
+    def run_jobs(self):
+        """Runs a step of each job in turn until the job budget for the frame is spent, removing the jobs which have
+        finished."""
+        started = self.clock()
+        while self.jobs:
+            for job in list(self.jobs):
+                name, step = job
+                if self.measure(name, step):
+                    self.jobs.remove(job)
+            if self.clock() - started >= self.job_budget:
+                break
+
+    def measure(self, name, function, *args):
+        """Calls function(*args), adding the time it takes to the timer of the given name. Returns what it returns."""
+        started = self.clock()
+        try:
+            return function(*args)
+        finally:
+            timer = self.timers.setdefault(name, {'calls': 0, 'time': 0.0})
+            timer['calls'] += 1
+            timer['time'] += self.clock() - started
+
+    def summary(self):
+        """Returns a table of the calls to and time spent in each task, job and phase, slowest first."""
+        lines = ["{} ticks, {:.2f}s dropped catching up".format(self.ticks, self.dropped)]
+        for name, timer in sorted(self.timers.items(), key=lambda item: -item[1]['time']):
+            lines.append("{:<12} {:>8} calls {:>9.3f}s {:>8.2f}ms per call".format(
+                name, timer['calls'], timer['time'], timer['time'] * 1000 / max(1, timer['calls'])))
+        return "\n".join(lines)
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+
+import numpy as np
+
+# The skewing factors between the square grid and the grid of triangles simplex noise is made of
+F2 = 0.5 * (np.sqrt(3.0) - 1.0)
+G2 = (3.0 - np.sqrt(3.0)) / 6.0
+
+# The gradient at each corner of the grid is one of these, picked by the permutation table
+GRADIENTS = np.array([(1, 1), (-1, 1), (1, -1), (-1, -1), (1, 0), (-1, 0), (1, 0), (-1, 0), (0, 1), (0, -1), (0, 1),
+                      (0, -1)], dtype=np.float64)
+
+# The gradient grids already built, by permutation table. Generators seeded alike, such as those of each chunk of a
+# world, share the same grids rather than building them again.
+GRID_CACHE_SIZE = 16
+grid_cache = {}
+
+
+def gradient_grids(perm):
+    """Returns the x and y parts of the gradient at every corner of the 256 by 256 grid the noise repeats over,
+    indexed [x, y], for a permutation table of the numbers 0 to 255. Every octave samples the same grid."""
+    perm = tuple(perm)
+    if perm not in grid_cache:
+        if len(grid_cache) >= GRID_CACHE_SIZE:
+            grid_cache.clear()
+
+        # the table is doubled so the sum of two entries never needs wrapping
+        table = np.array(perm * 2, dtype=np.int32)
+        x, y = np.mgrid[0:256, 0:256]
+        index = table[x + table[y]] % len(GRADIENTS)
+        grid_cache[perm] = (GRADIENTS[index, 0], GRADIENTS[index, 1])
+    return grid_cache[perm]
+
+
+class SimplexNoise:
+    """2D simplex noise and fractal Brownian motion over whole numpy arrays of coordinates at once. For the same
+    permutation table the noise is the same as noiselib's simplex_noise2 and fBm, which worked a point at a time."""
+    def __init__(self, perm):
+        self.grad_x, self.grad_y = gradient_grids(perm)
+
+    def noise(self, x, y):
+        """Returns the noise at each of the given coordinates, between -1 and 1."""
+        # find the triangle each point is in, and the point's offset from each of its three corners
+        s = (x + y) * F2
+        i, j = np.floor(x + s), np.floor(y + s)
+        t = (i + j) * G2
+        x0, y0 = x - (i - t), y - (j - t)
+
+        i1 = (x0 > y0).astype(np.int32)
+        j1 = 1 - i1
+        i, j = i.astype(np.int32) & 255, j.astype(np.int32) & 255
+
+        corners = [
+            (x0, y0, i, j),
+            (x0 - i1 + G2, y0 - j1 + G2, (i + i1) & 255, (j + j1) & 255),
+            (x0 - 1 + 2 * G2, y0 - 1 + 2 * G2, (i + 1) & 255, (j + 1) & 255)
+        ]
+
+        # each corner adds its gradient to the points within reach of it, fading out with distance
+        total = np.zeros(np.shape(x))
+        for dx, dy, corner_x, corner_y in corners:
+            falloff = np.maximum(0.5 - dx * dx - dy * dy, 0)
+            falloff *= falloff
+            total += falloff * falloff * (self.grad_x[corner_x, corner_y] * dx + self.grad_y[corner_x, corner_y] * dy)
+        return total * 70
+
+    def fbm(self, x, y, octaves=8, persistence=0.45):
+        """Returns fractal Brownian motion at each of the given coordinates, between -1 and 1. Each octave doubles
+        the frequency of the one before, down to the frequency of the coordinates themselves, and its amplitude is
+        the persistence times that of the one before. The result is the average of the octaves, weighted by their
+        amplitudes."""
+        total = np.zeros(np.shape(x))
+        amplitudes = 0
+        for octave in range(octaves):
+            frequency = 2.0 ** -(octaves - 1 - octave)
+            amplitude = persistence ** octave
+            total += self.noise(x * frequency, y * frequency) * amplitude
+            amplitudes += amplitude
+        return total / amplitudes
+
+    def field(self, origin, size, spacing=1, supersample=1, octaves=8, persistence=0.45):
+        """Returns fBm between 0 and 1 over a grid of tiles indexed [y, x], with the top left corner at the given
+        origin in tiles and each tile spacing units of noise across. The noise is sampled at the top left corner of
+        each tile, or with supersampling at the corner of each of supersample by supersample parts of each tile and
+        averaged over them."""
+        w, h = size
+        offsets = np.arange(supersample) / float(supersample)
+        xs = (np.arange(w)[:, None] + origin[0] + offsets).ravel() * spacing
+        ys = (np.arange(h)[:, None] + origin[1] + offsets).ravel() * spacing
+
+        y, x = np.meshgrid(ys, xs, indexing='ij')
+        samples = (self.fbm(x, y, octaves, persistence) + 1) / 2
+        return samples.reshape(h, supersample, w, supersample).mean(axis=(1, 3))
@@ -1,135 +1,102 @@
 #!/usr/bin/python
-import random
-
 from PIL import Image
 import numpy as np
 
 
 class DiamondSquare:
-    def __init__(self, res, corners):
-        """Sets up the diamond-square generator."""
-        self.map = []
-        #max and minimum values
+    def __init__(self, res, corners, seed=None):
+        """Sets up the diamond-square generator. The grid is res + 1 points across, and any resolution can be asked
+        for: the grid is generated at the next power of two up and cut down to size."""
         self.res = res + 1
         self.max = self.res - 1
         self.corners = corners
 
+        # The random numbers are drawn from their own seeded stream
+        self.random = np.random.RandomState(seed)
+
+        # The size of the grid which is generated, and the grid itself as a float32 array indexed [y, x]
+        self.size = 1
+        while self.size < self.max:
+            self.size *= 2
+        self.map = np.zeros((self.size + 1, self.size + 1), dtype=np.float32)
+
         self.lowValue = 0
         self.highValue = 0
 
-        for x in range(0, self.res):
-            for y in range(0, self.res):
-                self.map.append(-1)
-
     def get(self, xy):
         """Gets the brightness value at the coordinates supplied."""
         x, y = xy
         if x < 0 or x > self.max or y < 0 or y > self.max:
             return -1
-        return self.map[x + (self.res * y)]
+        return self.map[y, x]
+
     def set(self, xy, value):
         x, y = xy
-        self.map[x + (self.res * y)] = value
-
-    def average(self, values):
-        """Calculates the average of an input list of values if the values are greater than -1."""
-        items = [i for i in values if i != -1]
+        self.map[y, x] = value
 
-        return -1 if len(items) == 0 else sum(items) / len(items)
     def divide(self, res):
-        half = res / 2
-        scale = self.rough * res
-
-        if half < 1:
-            return
-
-        # Iterate recursively through square steps then diamond steps.
-        for y in range(half, self.max, res):
-            for x in range(half, self.max, res):
-                self.square((x, y), half, random.uniform(
-                    0.00, 1.00) * scale * 2 - scale)
-
-        for y in range(0, self.max + 1, half):
-            for x in range((y + half) % res, self.max + 1, res):
-                self.diamond((x, y), half, random.uniform(
-                    0.00, 1.00) * scale * 2 - scale)
-
-        self.divide(res / 2, )
-
-    def square(self, xy, res, change):
-        x, y = xy
-
-        t1 = self.get((x - res, y - res))
-        t2 = self.get((x + res, y - res))
-        b1 = self.get((x - res, y + res))
-        b2 = self.get((x + res, y + res))
-        val = self.average([t1, t2, b1, b2]) + change
-
-        if val < self.lowValue:
-            self.lowValue = val
-        elif val > self.highValue:
-            self.highValue = val
-
-        self.set(xy, val)
-    def diamond(self, xy, res, change):
-        x, y = xy
-
-        t = self.get((x, y - res))
-        r = self.get((x + res, y))
-        b = self.get((x, y + res))
-        l = self.get((x - res, y))
-        val = self.average([t, r, b, l]) + change
-
-        if val < self.lowValue:
-            self.lowValue = val
-        elif val > self.highValue:
-            self.highValue = val
-
-        self.set(xy, val)
+        """Runs the square step and then the diamond step for every point res / 2 from those already set, at once,
+        then carries on with the next size down until the whole grid is filled."""
+        grid = self.map
+        while res > 1:
+            half = res / 2
+            scale = self.rough * res
+
+            # Square step: the middle of each square is the average of its corners
+            middles = grid[half::res, half::res]
+            middles[...] = (grid[:-1:res, :-1:res] + grid[:-1:res, res::res] + grid[res::res, :-1:res] +
+                            grid[res::res, res::res]) * 0.25 + self.change(middles.shape, scale)
+
+            # Diamond step: the middle of each edge is the average of the corners either side of it and the middles
+            # of the squares either side of it. Edges along the sides of the grid only have one square, so they are
+            # the average of three points.
+            for edges, ends, axis in [(grid[::res, half::res], (grid[::res, :-1:res], grid[::res, res::res]), 0),
+                                      (grid[half::res, ::res], (grid[:-1:res, ::res], grid[res::res, ::res]), 1)]:
+                before, after = [slice(None)] * 2, [slice(None)] * 2
+                before[axis], after[axis] = slice(1, None), slice(None, -1)
+                first, last = [slice(None)] * 2, [slice(None)] * 2
+                first[axis], last[axis] = 0, -1
+
+                total = ends[0] + ends[1]
+                total[tuple(before)] += middles
+                total[tuple(after)] += middles
+                total *= 0.25
+                total[tuple(first)] *= 4 / 3.
+                total[tuple(last)] *= 4 / 3.
+                total += self.change(edges.shape, scale)
+                edges[...] = total
+
+            res = half
+
+    def change(self, shape, scale):
+        """Returns a random change of up to scale either way for each point of the given shape. The changes are
+        drawn as 16 bit integers, which is fine enough for heights and much faster to draw than floats."""
+        change = self.random.randint(0, 2 ** 16, shape, dtype=np.uint16).astype(np.float32)
+        change *= scale * 2 / (2 ** 16 - 1)
+        change -= scale
+        return change
 
     def generate(self, rough):
+        """Fills the grid, and returns it as a float32 array indexed [y, x], shifted so that nothing is below zero."""
         self.rough = rough
         self.set((0, 0), self.corners[0])
-        self.set((0, self.max), self.corners[1])
-        self.set((self.max, 0), self.corners[2])
-        self.set((self.max, self.max), self.corners[3])
-
-        self.divide(self.max)
-
-        if self.lowValue > 0:
-            self.lowValue = 0
+        self.set((0, self.size), self.corners[1])
+        self.set((self.size, 0), self.corners[2])
+        self.set((self.size, self.size), self.corners[3])
 
-        print "low value: ", self.lowValue
-        for x in range(0, len(self.map)):
-            self.map[x] -= self.lowValue
+        self.divide(self.size)
+        self.map = self.map[:self.res, :self.res]
 
-        self.highValue -= self.lowValue
+        self.lowValue = min(0, float(self.map.min()))
+        self.map -= self.lowValue
+        self.highValue = float(self.map.max())
+        return self.map
 
     def convert_table(self):
-        output = []
-
-        for x in range(0, self.res):
-            row = []
-            for y in range(0, self.res):
-                val = self.map[y + (x * self.res)]
-                row.append(val)
-            output.append(row)
-
-        return output
+        return self.map.tolist()
 
     def convert_to_image(self):
         """Convert the finished matrix to an RGB image"""
-        output = []
-
-        for x in range(0, self.res):
-            row = []
-            for y in range(0, self.res):
-                val = (self.map[y + (x * self.res)] / self.highValue) * 255  # normalize the values to 0-255 for rgb
-                row.append(val)
-            output.append(row)
-
-        array = np.asarray(output)
-        im = Image.fromarray(array)
-        if im.mode != 'RGB':
-            im = im.convert('RGB')
-        return im
\ No newline at end of file
+        # normalize the values to 0-255 for rgb
+        array = (self.map / max(self.highValue, 1e-6) * 255).astype(np.uint8)
+        return Image.fromarray(array).convert('RGB')
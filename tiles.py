@@ -0,0 +1,161 @@
+#!/usr/bin/python
+
+import numpy as np
+
+# Every tile the map can hold, paired with the index of its image in the tileset. A tile's position in this list is
+# the ID stored in the map layers; the image index can't be used as the ID because some tiles share an image.
+TILES = [
+    ('GROUND', 0),
+    ('GRASS', 1),
+    ('SAND', 2),
+    ('SHORE', 3),
+    ('OCEAN', 4),
+    ('SNOW', 6),
+
+    # resources
+    ('GROUNDCOAL', 8),
+    ('GRASSCOAL', 9),
+    ('SANDCOAL', 10),
+
+    ('GROUNDOIL', 6),
+    ('GRASSOIL', 7),
+    ('SANDOIL', 14),
+    ('WATEROIL', 15),
+
+    # items
+    ('PALMTREE', 11),
+    ('TREES', 12),
+    ('MOUNTAIN', 13),
+
+    ('ROAD', 31),
+    # road directions
+    ('ROAD_0', 16),
+    ('ROAD_1', 17),
+    ('ROAD_2', 18),
+    ('ROAD_3', 19),
+    ('ROAD_4', 20),
+    ('ROAD_5', 21),
+    ('ROAD_6', 22),
+    ('ROAD_7', 23),
+    ('ROAD_8', 24),
+    ('ROAD_9', 25),
+    ('ROAD_10', 26),
+    ('ROAD_11', 27),
+    ('ROAD_12', 28),
+    ('ROAD_13', 29),
+    ('ROAD_14', 30),
+
+    ('RIVER', 47),
+    # water directions
+    ('RIVER_0', 32),
+    ('RIVER_1', 33),
+    ('RIVER_2', 34),
+    ('RIVER_3', 35),
+    ('RIVER_4', 36),
+    ('RIVER_5', 37),
+    ('RIVER_6', 38),
+    ('RIVER_7', 39),
+    ('RIVER_8', 40),
+    ('RIVER_9', 41),
+    ('RIVER_10', 42),
+    ('RIVER_11', 43),
+    ('RIVER_12', 44),
+    ('RIVER_13', 45),
+    ('RIVER_14', 46),
+
+    # buildings
+    ('HOUSE', 48),
+    ('BIGHOUSE', 49),
+    ('APARTMENTS', 50),
+    ('STORE', 51),
+    ('BIGSTORE', 52),
+    ('POLICE', 53),
+    ('FIRE', 54),
+    ('MAYORS', 55),
+    ('MINE', 56),
+    ('OILRIG', 57),
+    ('FERRY', 58),
+
+    # UI
+    ('UI_EMPTY', 59),
+    ('CURSOR', 61),
+    ('UI_LOCKED', 62),
+    ('BULLDOZER', 63)
+]
+
+TILE_IDS = dict((name, i) for i, (name, image) in enumerate(TILES))
+TILE_NAMES = [name for name, image in TILES]
+
+# The tiles which it is not possible to place objects on
+IMPASSABLE = ['OCEAN', 'SHORE', 'ICE']
+
+
+def tile_table(names):
+    """Builds a lookup table over the tile IDs which is True for each of the given tile names."""
+    table = np.zeros(len(TILES), dtype=bool)
+    for name in names:
+        if name in TILE_IDS:
+            table[TILE_IDS[name]] = True
+    return table
+
+# The kinds of ore, each with the tile every ground tile becomes when the ore is found in it. Ground which isn't listed
+# can't hold the ore.
+ORE_TILES = [
+    ('coal', {'GRASS': 'GRASSCOAL', 'SAND': 'SANDCOAL', 'GROUND': 'GROUNDCOAL'}),
+    ('oil', {'GRASS': 'GRASSOIL', 'SAND': 'SANDOIL', 'GROUND': 'GROUNDOIL', 'SHORE': 'WATEROIL'})
+]
+COAL, OIL = 0, 1
+
+
+def ore_table():
+    """Builds a table indexed [ore, tile ID], with the ores in the order of ORE_TILES, giving the ID of the tile each
+    tile becomes with that ore, or -1 where it can't hold the ore. Tiles which already hold the ore stay as they are."""
+    table = np.full((len(ORE_TILES), len(TILES)), -1, dtype=np.int16)
+    for ore, (name, tiles) in enumerate(ORE_TILES):
+        for ground, tile in tiles.iteritems():
+            table[ore, TILE_IDS[ground]] = TILE_IDS[tile]
+            table[ore, TILE_IDS[tile]] = TILE_IDS[tile]
+    return table
+
+# The bits of a tile's connectivity mask, set when the tile joins up with its neighbour in that direction
+LINK_TOP = 1
+LINK_BOTTOM = 2
+LINK_LEFT = 4
+LINK_RIGHT = 8
+
+# The tiles which are drawn joined up to their neighbours, and the variant to draw for each combination of
+# connected directions (t: top, b: bottom, l: left, r: right)
+AUTOTILES = ['ROAD', 'RIVER']
+AUTOTILE_VARIANTS = {
+    't': 11,
+    'b': 12,
+    'l': 13,
+    'r': 14,
+    'lr': 0,
+    'tb': 1,
+    'tl': 2,
+    'tr': 3,
+    'bl': 4,
+    'br': 5,
+    'tbr': 6,
+    'tbl': 7,
+    'tlr': 8,
+    'blr': 9,
+    'tblr': 10
+}
+
+
+def autotile_table():
+    """Builds a table indexed [tile ID, connectivity mask] giving the ID of the tile to draw. Tiles which aren't
+    joined up to their neighbours always draw as themselves."""
+    table = np.zeros((len(TILES), 16), dtype=np.uint8)
+    table[:] = np.arange(len(TILES))[:, np.newaxis]
+
+    for name in AUTOTILES:
+        for mask in range(16):
+            directions = ''.join(letter for bit, letter in
+                                 [(LINK_TOP, 't'), (LINK_BOTTOM, 'b'), (LINK_LEFT, 'l'), (LINK_RIGHT, 'r')]
+                                 if mask & bit)
+            if directions in AUTOTILE_VARIANTS:
+                table[TILE_IDS[name], mask] = TILE_IDS["{}_{}".format(name, AUTOTILE_VARIANTS[directions])]
+    return table
@@ -2,10 +2,36 @@ import pygame
 
 import buildings
 import config
+import generators
 import map
 import player
 
 from player import Mayor
+from scheduler import Scheduler
+
+
+# The settings selected on the configuration screen when it first opens
+DEFAULT_SETTINGS = {
+    'map': "island",
+    'rainfall': "medium",
+    'resources': "medium",
+    'size': "medium",
+    'difficulty': "medium"
+}
+
+
+def map_data(settings):
+    """Converts the settings chosen on the configuration screen into the data a map is generated from."""
+    values = ["low", "medium", "high"]
+    return {
+        'map': settings['map'],
+        # Convert into integers
+        'rainfall': values.index(settings['rainfall']),
+        'resources': values.index(settings['resources']),
+        'size': values.index(settings['size']),
+        'difficulty': values.index(settings['difficulty']),
+        'seed': config.MAP_SEED
+    }
 
 
 class MenuScreen:
@@ -34,6 +60,10 @@ class MenuScreen:
         # Play the title music
         # self.title_music.play(-1)
 
+        # Start generating a map with the default settings while the player is still in the menus
+        if config.MAP_POOL is not None:
+            config.MAP_POOL.prefetch(map_data(DEFAULT_SETTINGS))
+
         clock = pygame.time.Clock()
         while True:
             clock.tick(30)
@@ -101,11 +131,11 @@ class ConfigureScreen:
         self.size_types = {}
         self.difficulty_types = {}
 
-        self.map_type = "island"
-        self.resource_type = "medium"
-        self.rainfall_type = "medium"
-        self.size_type = "medium"
-        self.difficulty_type = "medium"
+        self.map_type = DEFAULT_SETTINGS['map']
+        self.resource_type = DEFAULT_SETTINGS['resources']
+        self.rainfall_type = DEFAULT_SETTINGS['rainfall']
+        self.size_type = DEFAULT_SETTINGS['size']
+        self.difficulty_type = DEFAULT_SETTINGS['difficulty']
 
     def open(self):
         def set(var, value):
@@ -244,18 +274,24 @@ class ConfigureScreen:
             if button.rect.collidepoint(pos):
                 button.on_click()
 
+        data = map_data({
+            'map': self.map_type,
+            'rainfall': self.rainfall_type,
+            'resources': self.resource_type,
+            'size': self.size_type,
+            'difficulty': self.difficulty_type
+        })
+
         if self.generate_button.rect.collidepoint(pos):
             # When clicking the generate button
-            values = ["low", "medium", "high"]
-            data = {
-                'map': self.map_type,
-                # Convert into integers
-                'rainfall': values.index(self.rainfall_type),
-                'resources': values.index(self.resource_type),
-                'size': values.index(self.size_type),
-                'difficulty': values.index(self.difficulty_type)
-            }
-            self.callback(self.screen, 'game', True, data)
+            try:
+                self.callback(self.screen, 'game', True, data)
+            except generators.GenerationError, e:
+                # stay on the configuration screen so another map can be tried
+                print "Failed to generate map: {}".format(e)
+        elif config.MAP_POOL is not None:
+            # Start generating a map with the selected settings in case they are the ones the player goes with
+            config.MAP_POOL.prefetch(data)
 
     def draw(self, screen):
         self.screen.fill((255, 255, 255))
@@ -341,9 +377,11 @@ class GameScreen:
         # set up player
         self.player = Mayor(data['difficulty'])
 
-        # set up Map
+        # set up Map, using the map generated in the background if it is ready. Otherwise the game starts as soon as
+        # the start location is known, and the rest of the map is generated between frames
         tileset = map.Tileset("src/tileset.png")
-        self.map = map.Map(tileset, (80, 40), data)
+        payload = config.MAP_POOL.take(data) if config.MAP_POOL is not None else None
+        self.map = map.Map(tileset, (80, 40), data, payload, stream=True)
 
         # set up inventory
         self.inventory = [
@@ -374,61 +412,80 @@ class GameScreen:
             'broke': pygame.mixer.Sound("src/broke.wav")
         }
 
+        # The UI drawn over the map last frame, which needs removing before the next frame
+        self.overlays = []
+        self.first_frame = True
+
+        # The simulation runs at a fixed rate however fast the screen is drawn. Every 100 ticks calculate population
+        # and income, and every 300 ticks the safety services too.
+        self.scheduler = Scheduler(config.TICK_RATE)
+        self.scheduler.every(100, 'economy', self.player.calc, False)
+        self.scheduler.every(300, 'services', self.player.calc, True)
+
+        # carry on generating the map between frames, a stage at a time
+        self.scheduler.add_job('generation', self.map.generate_step)
 
     def open(self):
         clock = pygame.time.Clock()
 
-        count = 0
-
         # Main game loop
         while True:
-            # Keep a consistent clock time even if frame rate varies
-            clock.tick(30)
-
-            count += 1
-
-            # every cycle of 100 loops, calculate population and income
-            if count % 100 == 0:
-                self.player.calc(False)
-
-            # every cycle of 300 loops, calculate safety services
-            if count >= 300:
-                self.player.calc(True)
-                count = 0
-
-            # Interaction loop
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    exit()
-
-                if pygame.mouse.get_pressed()[0] and hasattr(event, 'pos'):
-                    self.click(event.pos)
-
-                # Controls for moving the map
-                if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_DOWN:
-                        self.map.move('down')
-                    if event.key == pygame.K_LEFT:
-                        self.map.move('left')
-                    if event.key == pygame.K_RIGHT:
-                        self.map.move('right')
-                    if event.key == pygame.K_UP:  # up ke
-                        self.map.move('up')
-
-            # Draw the screen and flip the pixels
-            self.draw()
-            pygame.display.flip()
+            clock.tick(config.FRAME_RATE)
+            self.scheduler.frame()
+            self.scheduler.measure('events', self.handle_events)
+
+            # Draw the screen and update the pixels which have changed
+            pygame.display.update(self.scheduler.measure('draw', self.draw))
+
+    def handle_events(self):
+        """Handles the input events which have arrived since the last frame."""
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                self.close()
+                exit()
+
+            if pygame.mouse.get_pressed()[0] and hasattr(event, 'pos'):
+                self.click(event.pos)
+
+            # Controls for moving the map
+            if event.type == pygame.KEYDOWN:
+                # F3 prints where the time is going
+                if event.key == pygame.K_F3:
+                    print self.scheduler.summary()
+                if event.key == pygame.K_DOWN:
+                    self.map.move('down')
+                if event.key == pygame.K_LEFT:
+                    self.map.move('left')
+                if event.key == pygame.K_RIGHT:
+                    self.map.move('right')
+                if event.key == pygame.K_UP:  # up ke
+                    self.map.move('up')
 
     def close(self):
         """Function to be run when the game screen is closed."""
-        pass
+        print self.scheduler.summary()
 
     def draw(self):
-        """Clear the screen and draw the UI. To be run every cycle."""
-        self.screen.fill((0, 0, 0))
+        """Draw the map and the UI over it, returning the list of screen rects which have changed. To be run every
+        cycle."""
+        size = self.screen.get_size()
         try:
+            # Remove the UI which was drawn over the map last frame
+            dirty = self.overlays
+            for rect in self.overlays:
+                self.screen.fill((0, 0, 0), rect)
+                self.map.restore(self.screen, rect)
+            self.overlays = []
+
             # Draw the map and any relevant UI
-            self.map.draw(self.screen, (0, 0))
+            dirty.extend(self.map.draw(self.screen, (0, 0)))
+
+            # The status bar and inventory are redrawn every frame
+            status_bar = pygame.Rect(0, 0, size[0], config.STATUSBAR_HEIGHT)
+            sidebar = pygame.Rect(0, config.STATUSBAR_HEIGHT, config.SIDEBAR_WIDTH, size[1] - config.STATUSBAR_HEIGHT)
+            self.screen.fill((0, 0, 0), status_bar)
+            self.screen.fill((0, 0, 0), sidebar)
+            dirty.extend([status_bar, sidebar])
 
             # If there's an active tile, draw its details
             if self.map.tile_at != None:
@@ -438,8 +495,10 @@ class GameScreen:
                 tile_at_shadow = config.FONT.render(text, 1, pygame.Color("black"))
                 tile_at_text = config.FONT.render(text, 1, pygame.Color("white"))
 
-                self.screen.blit(tile_at_shadow, (config.SIDEBAR_WIDTH + 9, config.SCREEN_SIZE[1] - 17))
-                self.screen.blit(tile_at_text, (config.SIDEBAR_WIDTH + 8, config.SCREEN_SIZE[1] - 18))
+                self.overlays.append(
+                    self.screen.blit(tile_at_shadow, (config.SIDEBAR_WIDTH + 9, config.SCREEN_SIZE[1] - 17)))
+                self.overlays.append(
+                    self.screen.blit(tile_at_text, (config.SIDEBAR_WIDTH + 8, config.SCREEN_SIZE[1] - 18)))
 
             # Draw the game screen interface
 
@@ -491,7 +550,8 @@ class GameScreen:
                         # Show a label indicating the item is currently locked
                         locked = config.FONT.render("[Locked]", 1, config.COLOR_GRAY)
 
-                        pygame.draw.rect(self.screen, (50, 50, 50), (x + 30, y, locked.get_rect().width + 10, 18))
+                        self.overlays.append(
+                            pygame.draw.rect(self.screen, (50, 50, 50), (x + 30, y, locked.get_rect().width + 10, 18)))
                         self.screen.blit(locked, (x + 35, y + 2))
                 else:
                     # If we are hovering over the current inventory item
@@ -502,12 +562,21 @@ class GameScreen:
                             "{}{}".format(item.text, " (${})".format(item.price) if item.price > 0 else ""), 1,
                             pygame.Color("white") if self.player.money > item.price else config.COLOR_R)
 
-                        pygame.draw.rect(self.screen, (0, 0, 0), (x + 30, y, item_and_price.get_rect().width + 10, 18))
+                        self.overlays.append(pygame.draw.rect(self.screen, (0, 0, 0),
+                                                              (x + 30, y, item_and_price.get_rect().width + 10, 18)))
                         self.screen.blit(item_and_price, (x + 35, y + 2))
                     self.screen.blit(icon, (x, y))
                 item.coords = (x, y)
                 y += 30
 
+            dirty.extend(self.overlays)
+
+            # The first frame draws the whole screen
+            if self.first_frame:
+                self.first_frame = False
+                return [self.screen.get_rect()]
+            return dirty
+
         except Exception, e:
             print e.message
             exit()
@@ -523,12 +592,10 @@ class GameScreen:
                 self.map.destroy = item.ID == 'BULLDOZER'
                 self.map.selected_item = item
 
-        for tile in self.map.visible_tiles:
-            if tile['coords'][0] + config.TILE_W > pos[0] > tile['coords'][0] \
-                    and tile['coords'][1] + config.TILE_H > pos[1] > tile['coords'][1]:
-                if item.building != None and not item.building.can_place(tile, self.map):
-                    return
-                self.add_to_tile(tile['map_xy'])
+        # nothing can be built until the map has finished generating, so the rivers and forests never land on it
+        loc = self.map.tile_at_pos(pos)
+        if loc is not None and self.map.generator is None:
+            self.add_to_tile(loc)
 
     def play_sound(self, sound):
         """Plays a sound from the UI sound library, if it exists"""
@@ -548,6 +615,7 @@ class GameScreen:
             if tile['layer_1'] not in ['UI_EMPTY', 'RIVER', 'MAYORS']:
                 if tile['layer_1'] == 'ROAD':
                     self.player.roads -= 1
+                self.player.remove_building(tile_xy)
                 self.map.set(tile_xy, 'layer_1', 'UI_EMPTY')
                 self.play_sound('delete')
                 self.player.money -= 20
@@ -561,7 +629,7 @@ class GameScreen:
             self.play_sound('place')
             self.player.money -= self.map.selected_item.price
             if self.map.selected_item.building != None:
-                self.player.add_building(self.map.selected_item.building)
+                self.player.add_building(self.map.selected_item.building, tile_xy)
             if self.map.selected_item.ID == 'ROAD':
                 self.player.roads += 1
 
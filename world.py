@@ -0,0 +1,137 @@
+#!/usr/bin/python
+
+import random
+import itertools
+import multiprocessing
+
+import numpy as np
+
+import mapfile
+from generators import MainGenerator, derive_seed, random_seed, gen_terrain, gen_beaches, gen_snow
+from heightfield import Heightfield
+from tiles import TILE_IDS
+
+# The size of the square chunks a world is generated in, and the margin of the neighbouring chunks generated around
+# each one so that the erosion and the automata carry on over the chunk borders
+CHUNK_SIZE = 256
+CHUNK_MARGIN = 16
+
+
+class WorldGenerator:
+    """Generates worlds too large to hold as a single heightfield, in square chunks which can be generated
+    independently and in parallel. Only the chunks being worked on are ever held in memory.
+
+    Each chunk is generated with a margin of its neighbours around it, which is thrown away afterwards. The noise
+    and the masks are found in world coordinates so they are continuous across the whole world, and the margin
+    gives the erosion and the beach and snow automata the surroundings they need to carry on over the borders.
+    Rivers, forests, ores and the start location need the whole map at once, so worlds only get the terrain."""
+    def __init__(self, data, size, chunk_size=CHUNK_SIZE, margin=CHUNK_MARGIN, supersample=1):
+        self.map_type = data['map']
+        self.rainfall = data['rainfall']
+        self.seed = data.get('seed')
+        if self.seed is None:
+            self.seed = random_seed()
+
+        # the same adjustments the game map generator makes for each map type
+        if self.map_type == "highlands":
+            self.rainfall -= 1 if self.rainfall > 0 else 0
+        elif self.map_type == "continents":
+            self.rainfall += 1
+        elif self.map_type == "deserts":
+            self.rainfall -= 1
+
+        self.size = size
+        self.chunk_size = chunk_size
+        self.margin = margin
+        self.supersample = supersample
+
+    def chunks(self):
+        """Returns the (x, y) index of every chunk in the world, row by row."""
+        columns = (self.size[0] + self.chunk_size - 1) // self.chunk_size
+        rows = (self.size[1] + self.chunk_size - 1) // self.chunk_size
+        return [(x, y) for y in range(rows) for x in range(columns)]
+
+    def chunk_area(self, chunk):
+        """Returns the (x, y, width, height) of the chunk in the world, and of the chunk with its margin, clipped to
+        the edges of the world."""
+        x, y = chunk[0] * self.chunk_size, chunk[1] * self.chunk_size
+        w, h = min(self.chunk_size, self.size[0] - x), min(self.chunk_size, self.size[1] - y)
+
+        left, top = max(0, x - self.margin), max(0, y - self.margin)
+        right, bottom = min(self.size[0], x + w + self.margin), min(self.size[1], y + h + self.margin)
+        return (x, y, w, h), (left, top, right - left, bottom - top)
+
+    def generate_chunk(self, chunk):
+        """Generates a single chunk, returning a dictionary of its planes."""
+        (x, y, w, h), (left, top, width, height) = self.chunk_area(chunk)
+
+        generator = MainGenerator(self.seed)
+        noise = generator.gen_noise((left, top), (width, height), self.supersample)
+        slate = Heightfield((width, height), noise.data, (left, top), self.size)
+
+        if self.map_type == "continents":
+            slate = generator.gen_continents(None, self.rainfall, slate)
+        elif self.map_type == "highlands":
+            slate = generator.gen_highlands(None, self.rainfall, slate)
+        else:
+            slate = generator.gen_island(None, self.rainfall, slate)
+
+        layer_0 = np.zeros((height, width), dtype=np.uint8)
+        layer_1 = np.empty((height, width), dtype=np.uint8)
+        layer_1[:] = TILE_IDS['UI_EMPTY']
+
+        # each chunk draws from streams of its own, so chunks can be generated in any order
+        gen_terrain(slate.data, layer_0, layer_1, self.map_type,
+                    random.Random(derive_seed(self.seed, 'terrain', chunk[0], chunk[1])))
+        if self.map_type not in ['deserts', 'highlands']:
+            layer_0 = gen_beaches(layer_0, layer_1, random.Random(derive_seed(self.seed, 'beaches', chunk[0], chunk[1])))
+        layer_0 = gen_snow(layer_0)
+
+        # cut the margin away
+        inside = (slice(y - top, y - top + h), slice(x - left, x - left + w))
+        return {
+            'heights': slate.data[inside].astype(np.float32),
+            'layer_0': layer_0[inside],
+            'layer_1': layer_1[inside]
+        }
+
+    def generate(self, write, workers=1):
+        """Generates every chunk of the world, passing each one to write(chunk, (x, y, width, height), planes) as it
+        is finished. With more than one worker the chunks are generated in parallel and arrive in any order."""
+        tasks = [(self, chunk) for chunk in self.chunks()]
+
+        if workers > 1:
+            pool = multiprocessing.Pool(workers)
+            results = pool.imap_unordered(generate_chunk, tasks)
+        else:
+            pool = None
+            results = itertools.imap(generate_chunk, tasks)
+
+        for chunk, planes in results:
+            write(chunk, self.chunk_area(chunk)[0], planes)
+
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def generate_chunk(task):
+    """Generates a chunk of a world in a worker process."""
+    world, chunk = task
+    return chunk, world.generate_chunk(chunk)
+
+
+def save_world(world, path, workers=1):
+    """Generates a world into a map file, writing each chunk as it is finished so the whole world never has to fit in
+    memory. The map file can be opened by Map like any other."""
+    map_file = mapfile.create_map_file(path, world.size, mapfile.PLANES + [('heights', np.float32)], seed=world.seed)
+
+    # worlds have no roads or rivers, so the links plane is left empty
+    def write(chunk, area, planes):
+        x, y, w, h = area
+        for name, plane in planes.iteritems():
+            map_file.planes[name][y:y + h, x:x + w] = plane
+
+    world.generate(write, workers)
+    map_file.flush()
+    return map_file